@@ -15,7 +15,7 @@ from ethereum.securetrie import SecureTrie
 from ethereum import utils
 from ethereum.utils import address, int256, trie_root, hash32, to_string
 from ethereum import processblock
-from ethereum.transactions import Transaction
+from ethereum.transactions import Transaction, recover_senders
 from ethereum import bloom
 from ethereum.exceptions import UnknownParentException, VerificationFailed
 from ethereum.slogging import get_logger
@@ -375,6 +375,8 @@ class Block(rlp.Serializable):
         self.env = env # don't re-set after init
         self.db = env.db
         self.config = env.config
+        self.snapshots = env.snapshots
+        self.state_cache = env.state_cache
 
         self.header = header
         self.uncles = uncles
@@ -449,16 +451,25 @@ class Block(rlp.Serializable):
             assert transaction_list is not None
             if not parent:
                 parent = self.get_parent_header()
-            self.state = SecureTrie(Trie(self.db, parent.state_root))
+            self.state = SecureTrie(Trie(self.db, parent.state_root,
+                                         deferred=True))
             self.transaction_count = 0
             self.gas_used = 0
             # replay
-            for tx in transaction_list:
-                success, output = processblock.apply_transaction(self, tx)
+            recover_senders(transaction_list)
+            processes = self.config.get('SPECULATIVE_EXECUTION_PROCESSES')
+            if processes:
+                from ethereum import speculative
+                speculative.apply_transactions(self, transaction_list,
+                                               processes)
+            else:
+                for tx in transaction_list:
+                    success, output = processblock.apply_transaction(self, tx)
             self.finalize()
         else:
             # trust the state root in the header
-            self.state = SecureTrie(Trie(self.db, header._state_root))
+            self.state = SecureTrie(Trie(self.db, header._state_root,
+                                         deferred=True))
             self.transaction_count = 0
             if transaction_list:
                 for tx in transaction_list:
@@ -603,7 +614,7 @@ class Block(rlp.Serializable):
 
     @state_root.setter
     def state_root(self, value):
-        self.state = SecureTrie(Trie(self.db, value))
+        self.state = SecureTrie(Trie(self.db, value, deferred=True))
         self.reset_cache()
 
     @property
@@ -690,6 +701,29 @@ class Block(rlp.Serializable):
         """`True` if this block is the genesis block, otherwise `False`."""
         return self.header.number == 0
 
+    def _snapshot_root(self):
+        """The state root to look up in the state snapshots, `None` if
+        there are no snapshots or the state has uncommitted changes.
+        """
+        t = self.state.trie
+        if self.snapshots is None or not t.deferred or t.dirty:
+            return None
+        return t.committed_root_hash
+
+    def _get_acct_rlp(self, address):
+        """Get the rlp encoded account with the given binary address from
+        the state snapshots, or from the state trie if they miss.
+        """
+        root = self._snapshot_root()
+        if root is not None:
+            rlpdata = self.snapshots.account(root, address)
+            if rlpdata is not None:
+                return rlpdata
+        rlpdata = self.state.get(address)
+        if root is not None:
+            self.snapshots.fill_account(root, address, rlpdata)
+        return rlpdata
+
     def _get_acct(self, address):
         """Get the account with the given address.
 
@@ -698,9 +732,38 @@ class Block(rlp.Serializable):
         if len(address) == 40:
             address = decode_hex(address)
         assert len(address) == 20 or len(address) == 0
-        rlpdata = self.state.get(address)
+        return self._decode_acct(self._get_acct_rlp(address))
+
+    def _get_accts(self, addresses):
+        """Get the accounts with the given binary addresses in a single
+        lookup.
+
+        Note that this method ignores cached account items.
+        """
+        root = self._snapshot_root()
+        if root is None:
+            return [self._decode_acct(rlpdata)
+                    for rlpdata in self.state.get_many(addresses)]
+        rlps = [self.snapshots.account(root, a) for a in addresses]
+        missing = [a for a, rlpdata in zip(addresses, rlps) if rlpdata is None]
+        found = dict(zip(missing, self.state.get_many(missing)))
+        for a in missing:
+            self.snapshots.fill_account(root, a, found[a])
+        return [self._decode_acct(found[a] if rlpdata is None else rlpdata)
+                for a, rlpdata in zip(addresses, rlps)]
+
+    def _decode_acct(self, rlpdata):
         if rlpdata != trie.BLANK_NODE:
-            acct = rlp.decode(rlpdata, Account, db=self.db)
+            fields = None
+            if self.state_cache is not None:
+                fields = self.state_cache.get_account(rlpdata)
+            if fields is None:
+                acct = rlp.decode(rlpdata, Account, db=self.db)
+                if self.state_cache is not None:
+                    self.state_cache.put_account(rlpdata, (
+                        acct.nonce, acct.balance, acct.storage, acct.code_hash))
+            else:
+                acct = Account(fields[0], fields[1], fields[2], fields[3], self.db)
             acct._mutable = True
             acct._cached_rlp = None
         else:
@@ -721,10 +784,23 @@ class Block(rlp.Serializable):
             return self.caches[param][address]
         else:
             account = self._get_acct(address)
-            o = getattr(account, param)
+            if param == 'code':
+                o = self._get_code(account.code_hash)
+            else:
+                o = getattr(account, param)
             self.caches[param][address] = o
             return o
 
+    def _get_code(self, code_hash):
+        """Get code by its hash, through the state cache."""
+        if self.state_cache is None:
+            return self.db.get(code_hash)
+        code = self.state_cache.get_code(code_hash)
+        if code is None:
+            code = self.db.get(code_hash)
+            self.state_cache.put_code(code_hash, code)
+        return code
+
     def _set_acct_item(self, address, param, value):
         """Set a specific parameter of a specific account.
 
@@ -778,6 +854,9 @@ class Block(rlp.Serializable):
         r = self.mk_transaction_receipt(tx)
         self.receipts.update(k, rlp.encode(r))
         self.bloom |= r.bloom  # int
+        if len(self._get_transactions_cache) == self.transaction_count:
+            # saves decoding the transaction again in get_transactions
+            self._get_transactions_cache.append(tx)
         self.transaction_count += 1
 
     def get_transaction(self, num):
@@ -949,11 +1028,20 @@ class Block(rlp.Serializable):
             if index in self.caches[CACHE_KEY]:
                 return self.caches[CACHE_KEY][index]
         key = utils.zpad(utils.coerce_to_bytes(index), 32)
+        # snapshots only know the committed storage, which reset_storage
+        # (the only writer of storage roots) discards
+        root = None
+        if self.caches['storage'].get(address) != b'':
+            root = self._snapshot_root()
+        if root is not None:
+            value = self.snapshots.storage_value(root, address, key)
+            if value is not None:
+                return value
         storage = self.get_storage(address).get(key)
-        if storage:
-            return rlp.decode(storage, big_endian_int)
-        else:
-            return 0
+        value = rlp.decode(storage, big_endian_int) if storage else 0
+        if root is not None:
+            self.snapshots.fill_storage(root, address, key, value)
+        return value
 
     def set_storage_data(self, address, index, value):
         """Set a specific item in the storage of an account.
@@ -975,7 +1063,7 @@ class Block(rlp.Serializable):
         if len(address) == 40:
             address = decode_hex(address)
         assert len(address) == 20
-        return len(self.state.get(address)) > 0 or address in self.caches['all']
+        return len(self._get_acct_rlp(address)) > 0 or address in self.caches['all']
 
     def add_log(self, log):
         self.logs.append(log)
@@ -989,21 +1077,28 @@ class Block(rlp.Serializable):
         if len(self.journal) == 0:
             # log_state.trace('delta', changes=[])
             return
+        # the changes also make up the diff layer for the state snapshots
+        parent_root = self._snapshot_root()
+        diff_accounts, diff_storage, diff_destructs = {}, {}, set()
         addresses = sorted(list(self.caches['all'].keys()))
-        for addr in addresses:
-            acct = self._get_acct(addr)
+        for addr, acct in zip(addresses, self._get_accts(addresses)):
 
             # storage
+            storage_root = acct.storage
             for field in ('balance', 'nonce', 'code', 'storage'):
                 if addr in self.caches[field]:
                     v = self.caches[field][addr]
                     changes.append([field, addr, v])
                     setattr(acct, field, v)
+            if acct.storage != storage_root:
+                diff_destructs.add(addr)
 
-            t = SecureTrie(Trie(self.db, acct.storage))
+            t = SecureTrie(Trie(self.db, acct.storage, deferred=True))
+            slots = diff_storage[addr] = {}
             for k, v in self.caches.get(b'storage:' + addr, {}).items():
                 enckey = utils.zpad(utils.coerce_to_bytes(k), 32)
                 val = rlp.encode(v)
+                slots[enckey] = v
                 changes.append(['storage', addr, k, v])
                 # if self.number > 18280 and False:
                 #     try:
@@ -1018,7 +1113,12 @@ class Block(rlp.Serializable):
                 else:
                     t.delete(enckey)
             acct.storage = t.root_hash
-            self.state.update(addr, rlp.encode(acct))
+            diff_accounts[addr] = rlp.encode(acct)
+            self.state.update(addr, diff_accounts[addr])
+        self.state.commit()
+        if parent_root is not None:
+            self.snapshots.update(parent_root, self._snapshot_root(),
+                                  diff_accounts, diff_storage, diff_destructs)
         log_state.trace('delta', changes=changes)
         self.reset_cache()
         self.db.put_temporarily(b'validated:' + self.hash, '1')
@@ -1032,7 +1132,12 @@ class Block(rlp.Serializable):
             address = decode_hex(address)
         assert len(address) == 20
         self.commit_state()
+        parent_root = self._snapshot_root()
         self.state.delete(address)
+        if parent_root is not None:
+            self.state.commit()
+            self.snapshots.update(parent_root, self._snapshot_root(),
+                                  {address: b''}, {}, set([address]))
 
     def account_to_dict(self, address, with_storage_root=False,
                         with_storage=True):
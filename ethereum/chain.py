@@ -1,20 +1,50 @@
 import os
 import time
+from collections import deque
 from ethereum import utils
 from ethereum import pruning_trie as trie
-from ethereum.refcount_db import RefcountDB
+from ethereum.refcount_db import RefcountDB, RetentionPolicy
 from ethereum.db import OverlayDB
 from ethereum.utils import to_string, is_string
 import rlp
 from rlp.utils import encode_hex
 from ethereum import blocks
+from ethereum import ethpow
 from ethereum import processblock
+from ethereum.exceptions import InvalidTransaction, UnknownParentException, \
+    VerificationFailed
+from ethereum.transactions import Transaction, recover_senders, sender_cache
 from ethereum.slogging import get_logger
 from ethereum.config import Env
 import sys
 log = get_logger('eth.chain')
 
 
+def _prepare_block(rlpdata):
+    """Check the proofs of work and recover the senders of an rlp encoded
+    block ahead of its import.
+
+    :returns: `(pow_results, senders)`, lists of arguments for
+              :func:`ethpow.add_pow_result` and `sender_cache.put`
+    """
+    pow_results, senders = [], []
+    try:
+        header, txs, uncles = rlp.decode(rlpdata)
+        for h in [header] + uncles:
+            h = blocks.BlockHeader.deserialize(h)
+            key = (h.number, h.mining_hash, h.mixhash, h.nonce, h.difficulty)
+            pow_results.append((key, ethpow.check_pow(*key)))
+        txs = [Transaction.deserialize(tx) for tx in txs]
+    except (rlp.RLPException, InvalidTransaction, ValueError):
+        # invalid, left to the import to find out
+        return pow_results, senders
+    recover_senders(txs, parallel=False)
+    for tx in txs:
+        if tx._sender and tx.v:
+            senders.append((tx._signature_key(), tx._sender))
+    return pow_results, senders
+
+
 class Index(object):
 
     """"
@@ -109,11 +139,23 @@ class Chain(object):
                           the new head
     """
     head_candidate = None
+    # death row entries pruned per imported block, the rest is left to prune()
+    prune_budget = 10000
+    # epochs of death rows that may be left over before add_block prunes
+    # more than prune_budget
+    max_prune_backlog = 64
+    # times prune_budget add_block prunes on top of it while the backlog is
+    # larger than max_prune_backlog
+    backlog_prune_factor = 4
 
     def __init__(self, env, genesis=None, new_head_cb=None, coinbase='\x00' * 20):
         assert isinstance(env, Env)
         self.env = env
         self.db = self.blockchain = env.db
+        if isinstance(self.db, RefcountDB):
+            self.db.prune_budget = self.prune_budget
+            if not self.db.policy_given:
+                self.db.policy = RetentionPolicy.from_config(env.config)
         self.new_head_cb = new_head_cb
         self.index = Index(self.env)
         self._coinbase = coinbase
@@ -215,7 +257,10 @@ class Chain(object):
 
         # create block
         ts = max(int(time.time()), self.head.timestamp + 1)
-        _env = Env(OverlayDB(self.head.db), self.env.config, self.env.global_config)
+        # the states of the head candidate never become canonical, so it
+        # records them in a snapshot tree of its own
+        _env = Env(OverlayDB(self.head.db), self.env.config, self.env.global_config,
+                   None, self.env.state_cache, self.env.code_db)
         head_candidate = blocks.Block.init_from_parent(self.head, coinbase=self._coinbase,
                                                        timestamp=ts, uncles=uncles, env=_env)
         assert head_candidate.validate_uncles()
@@ -233,8 +278,7 @@ class Chain(object):
             if pending:
                 if forward_pending_transactions:
                     log.debug('forwarding pending transactions', num=len(pending))
-                    for tx in pending:
-                        self.add_transaction(tx)
+                    self.add_transactions(pending)
                 else:
                     log.debug('discarding pending transactions', num=len(pending))
 
@@ -282,6 +326,23 @@ class Chain(object):
     def commit(self):
         self.blockchain.commit()
 
+    def prune(self, budget=None):
+        """Continue pruning death rows left over by :meth:`add_block`.
+
+        Meant to be called repeatedly while idle, returns `True` once there
+        is nothing left to prune.
+
+        :param budget: the number of death row entries to look at, `None`
+                       for :attr:`prune_budget`
+        """
+        if not isinstance(self.db, RefcountDB):
+            return True
+        if budget is None:
+            budget = self.prune_budget
+        done = self.db.prune(budget)
+        self.commit()
+        return done
+
     def add_block(self, block, forward_pending_transactions=True):
         "returns True if block was added sucessfully"
         _log = log.bind(block_hash=block)
@@ -327,8 +388,60 @@ class Chain(object):
         block.state.db.commit_refcount_changes(block.number)
         block.state.db.cleanup(block.number)
         self.commit()  # batch commits all changes that came with the new block
+        if isinstance(self.db, RefcountDB) and \
+                self.db.prune_backlog() > self.max_prune_backlog:
+            self.prune(self.db.prune_budget * self.backlog_prune_factor)
         return True
 
+    def import_blocks(self, rlps, processes=None, lookahead=64):
+        """Import a sequence of rlp encoded blocks, each one after its
+        parent.
+
+        The proofs of work of the next `lookahead` blocks are checked and
+        their senders recovered on a pool of `processes` worker processes
+        (`None` for one per cpu) while the blocks before them are executed
+        and added with :meth:`add_block`. `rlps` is only consumed as far as
+        needed to keep the workers busy.
+
+        :returns: the number of blocks added, the import stops at the first
+                  block that could not be added
+        """
+        rlps = iter(rlps)
+        pending = deque()
+        added = 0
+        with utils.worker_pool(processes) as pool:
+            if pool is None:
+                log.debug('preparing blocks in process')
+            while True:
+                while len(pending) < lookahead:
+                    rlpdata = next(rlps, None)
+                    if rlpdata is None:
+                        break
+                    prepared = None
+                    if pool:
+                        prepared = pool.apply_async(_prepare_block, (rlpdata,))
+                    pending.append((rlpdata, prepared))
+                if not pending:
+                    break
+                rlpdata, prepared = pending.popleft()
+                if prepared is not None:
+                    pow_results, senders = prepared.get()
+                    for key, result in pow_results:
+                        ethpow.add_pow_result(key, result)
+                    for key, sender in senders:
+                        sender_cache.put(key, sender)
+                try:
+                    block = blocks.Block.deserialize(rlp.decode(rlpdata),
+                                                     env=self.env)
+                except (UnknownParentException, VerificationFailed,
+                        InvalidTransaction, rlp.RLPException, ValueError) as e:
+                    log.debug('invalid block', error=e, num_added=added)
+                    break
+                if not self.add_block(block):
+                    break
+                added += 1
+        return added
+
     def get_children(self, block):
         return [self.get(c) for c in self.index.get_children(block.hash)]
 
@@ -372,6 +485,17 @@ class Chain(object):
         assert old_state_root != head_candidate.state_root
         return True
 
+    def add_transactions(self, transactions):
+        """Add several transactions to the :attr:`head_candidate` block.
+
+        The senders of all transactions are recovered as one batch, in
+        parallel if it is large, before they are applied one by one.
+
+        :returns: the results of :meth:`add_transaction`
+        """
+        recover_senders(transactions)
+        return [self.add_transaction(tx) for tx in transactions]
+
     def get_transactions(self):
         """Get a list of new transactions not yet included in a mined block
         but known to the chain.
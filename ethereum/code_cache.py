@@ -0,0 +1,79 @@
+import marshal
+import sys
+from ethereum import opcodes, utils
+from ethereum.lru import LRUCache
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.vm.code_cache')
+
+# Upper bound for the estimated size of the analyses held by one cache
+DEFAULT_CODE_CACHE_SIZE = 32 * 1024 * 1024
+# Prefix of the database keys of persisted analyses
+DB_PREFIX = b'code_analysis:'
+# Persisted analyses are only read by the python and marshal version they
+# were written with, and with the opcode table they were made with as they
+# include the fees of the instructions
+DB_VERSION = utils.to_string('py%d%d-m%d-' % (sys.version_info[:2] +
+                                              (marshal.version,))) + \
+    utils.encode_hex(utils.sha3(repr(sorted(opcodes.opcodes.items())))[:4])
+
+
+class CodeCache(LRUCache):
+
+    """
+    LRU cache of the analysis an interpreter makes of contract code.
+
+    Entries are looked up by the code itself, whose hash python caches on
+    the string, and their size is estimated as `byte_size` per byte of
+    code. Caches with a `name` persist their analyses in the database given
+    to `get`, which has to be a raw one as the entries are never deleted:
+    analyses missing in memory are read from it, and new ones written to
+    it, so they are reused across processes and restarts. Persisted
+    analyses have to be marshallable, and `name` has to change whenever
+    their format does. With a `base` cache the analysis is made from the
+    one of `base`, which is persisted instead.
+    """
+
+    def __init__(self, analyse, byte_size, name=None,
+                 max_size=DEFAULT_CODE_CACHE_SIZE, base=None):
+        super(CodeCache, self).__init__(max_size)
+        self.analyse = analyse
+        self.byte_size = byte_size
+        self.name = name
+        self.base = base
+
+    def _db_key(self, code):
+        return DB_PREFIX + self.name + b':' + DB_VERSION + b':' + \
+            utils.sha3(code)
+
+    def _load(self, code, db):
+        try:
+            data = db.get(self._db_key(code))
+        except KeyError:
+            return None
+        try:
+            return marshal.loads(data)
+        except (ValueError, EOFError, TypeError):
+            log.debug('invalid persisted analysis', name=self.name)
+            return None
+
+    def get(self, code, db=None):
+        """The analysis of `code`, made by `analyse` if it is not cached."""
+        analysis = super(CodeCache, self).get(code)
+        if analysis is not None:
+            return analysis
+        if self.base is not None:
+            analysis = self.analyse(self.base.get(code, db))
+        else:
+            persist = db is not None and self.name is not None
+            analysis = self._load(code, db) if persist else None
+            if analysis is None:
+                analysis = self.analyse(code)
+                if persist:
+                    db.put(self._db_key(code), marshal.dumps(analysis))
+        self.put(code, analysis, len(code) * (self.byte_size + 1))
+        return analysis
+
+    def __repr__(self):
+        return '<CodeCache %s entries=%d size=%d hits=%d misses=%d>' % \
+            (self.name, len(self.entries), self.size, self.hits, self.misses)
@@ -1,5 +1,8 @@
 from ethereum import utils
 from ethereum.db import BaseDB
+from ethereum.refcount_db import RefcountDB
+from ethereum.snapshot import SnapshotTree
+from ethereum.state_cache import StateCache
 
 default_config = dict(
     # Genesis block difficulty
@@ -46,6 +49,25 @@ default_config = dict(
     # Homestead fork
     HOMESTEAD_FORK_BLKNUM=1150000,
     HOMESTEAD_DIFF_ADJUSTMENT_CUTOFF=10,
+    # State pruning: 'archive' keeps everything, 'keep_last' keeps the state
+    # of the last PRUNING_KEEP_LAST blocks and 'checkpoints' additionally
+    # keeps the state of every PRUNING_CHECKPOINT_INTERVAL-th block
+    PRUNING_MODE='keep_last',
+    PRUNING_KEEP_LAST=500,
+    PRUNING_CHECKPOINT_INTERVAL=None,
+    # Number of diff layers of recent state changes kept by the state
+    # snapshot, 0 disables the snapshot
+    SNAPSHOT_LAYERS=128,
+    # Size in bytes of the cache of decoded accounts and code shared by all
+    # blocks of an env, 0 disables the cache
+    STATE_CACHE_SIZE=16 * 1024 * 1024,
+    # Number of processes speculatively executing the transactions of
+    # imported blocks in parallel, 0 executes them sequentially. The worker
+    # processes are forked and share the database.
+    SPECULATIVE_EXECUTION_PROCESSES=0,
+    # Engine executing contract code: 'vm' interprets every instruction,
+    # 'fastvm' checks gas and stack once per precompiled basic block
+    VM_ENGINE='vm',
 )
 assert default_config['NEPHEW_REWARD'] == \
     default_config['BLOCK_REWARD'] // 32
@@ -53,8 +75,21 @@ assert default_config['NEPHEW_REWARD'] == \
 
 class Env(object):
 
-    def __init__(self, db, config=None, global_config=None):
+    def __init__(self, db, config=None, global_config=None, snapshots=None,
+                 state_cache=None, code_db=None):
         assert isinstance(db, BaseDB)
         self.db = db
         self.config = config or dict(default_config)
         self.global_config = global_config or dict()
+        # flat state snapshots, may be shared by envs over related dbs
+        if snapshots is None and self.config.get('SNAPSHOT_LAYERS'):
+            snapshots = SnapshotTree(self.config['SNAPSHOT_LAYERS'])
+        self.snapshots = snapshots
+        if state_cache is None and self.config.get('STATE_CACHE_SIZE'):
+            state_cache = StateCache(self.config['STATE_CACHE_SIZE'])
+        self.state_cache = state_cache
+        # raw database the vm persists its code analyses in, they are never
+        # deleted so it must not count references
+        assert code_db is None or (isinstance(code_db, BaseDB) and
+                                   not isinstance(code_db, RefcountDB))
+        self.code_db = code_db
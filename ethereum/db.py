@@ -1,6 +1,11 @@
 from ethereum import utils
+from ethereum.node_cache import NodeCache
 from ethereum.slogging import get_logger
 from rlp.utils import str_to_bytes
+try:
+    import leveldb
+except ImportError:
+    leveldb = None
 log = get_logger('db')
 
 
@@ -8,7 +13,19 @@ databases = {}
 
 
 class BaseDB(object):
-    pass
+
+    _node_cache = None
+
+    @property
+    def node_cache(self):
+        """The cache of trie nodes decoded from this database."""
+        if self._node_cache is None:
+            self._node_cache = NodeCache()
+        return self._node_cache
+
+    def _discard_node(self, key):
+        if self._node_cache is not None:
+            self._node_cache.discard(key)
 
 
 class _EphemDB(BaseDB):
@@ -25,6 +42,7 @@ class _EphemDB(BaseDB):
 
     def delete(self, key):
         del self.db[key]
+        self._discard_node(key)
 
     def commit(self):
         pass
@@ -61,7 +79,106 @@ class _EphemDB(BaseDB):
         self.dec_refcount(key)
 
 
-DB = EphemDB = _EphemDB
+EphemDB = _EphemDB
+
+
+class LevelDB(BaseDB):
+
+    """
+    Persistent key-value store on top of LevelDB.
+
+    Writes are buffered in `uncommitted` (deletes are stored as `None`) and
+    flushed to disk as a single atomic WriteBatch on `commit`, so everything
+    that happens between two commits (e.g. a whole block in `Chain.add_block`)
+    either lands on disk completely or not at all.
+    """
+
+    def __init__(self, dbfile):
+        if leveldb is None:
+            raise ImportError("LevelDB requires the 'leveldb' package")
+        log.info('opening LevelDB', path=dbfile)
+        self.dbfile = dbfile
+        self.db = leveldb.LevelDB(dbfile)
+        self.uncommitted = dict()
+        self.kv = None
+
+    def get(self, key):
+        if key in self.uncommitted:
+            if self.uncommitted[key] is None:
+                raise KeyError("key not in db")
+            return self.uncommitted[key]
+        return self.db.Get(key)
+
+    def put(self, key, value):
+        self.uncommitted[key] = value
+
+    def delete(self, key):
+        self.uncommitted[key] = None
+        self._discard_node(key)
+
+    def commit(self):
+        log.debug('committing', db=self, num=len(self.uncommitted))
+        batch = leveldb.WriteBatch()
+        for k, v in self.uncommitted.items():
+            if v is None:
+                batch.Delete(k)
+            else:
+                batch.Put(k, v)
+        self.db.Write(batch, sync=False)
+        self.uncommitted.clear()
+
+    def _has_key(self, key):
+        try:
+            self.get(key)
+            return True
+        except KeyError:
+            return False
+
+    def __contains__(self, key):
+        return self._has_key(key)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.db == other.db
+
+    def __hash__(self):
+        # the repr changes with every write, the path stays the same
+        return hash(self.dbfile)
+
+    def __repr__(self):
+        return '<LevelDB at %s uncommitted=%d>' % (self.dbfile, len(self.uncommitted))
+
+    def inc_refcount(self, key, value):
+        self.put(key, value)
+
+    def dec_refcount(self, key):
+        pass
+
+    def revert_refcount_changes(self, epoch):
+        pass
+
+    def commit_refcount_changes(self, epoch):
+        pass
+
+    def cleanup(self, epoch):
+        pass
+
+    def put_temporarily(self, key, value):
+        self.inc_refcount(key, value)
+        self.dec_refcount(key)
+
+
+def DB(dbfile=None):
+    """Open the persistent database at `dbfile`, or an ephemeral in-memory
+    database if no path is given.
+
+    LevelDB holds an exclusive lock on its directory, so handles are shared
+    per path.
+    """
+    if dbfile is None:
+        return _EphemDB()
+    if dbfile not in databases:
+        databases[dbfile] = LevelDB(dbfile)
+    return databases[dbfile]
 
 
 # Used for SPV proof creation
@@ -118,6 +235,7 @@ class OverlayDB(BaseDB):
 
     def delete(self, key):
         self.overlay[key] = None
+        self._discard_node(key)
 
     def commit(self):
         pass
@@ -1,18 +1,13 @@
 from ethereum import ethash, ethash_utils, utils
 import time
-import sys
 import sha3
 import warnings
 from collections import OrderedDict
+from ethereum.lru import LRUCache
 from ethereum.slogging import get_logger
 
 log = get_logger('eth.pow')
 
-if sys.version_info.major == 2:
-    from repoze.lru import lru_cache
-else:
-    from functools import lru_cache
-
 try:
     import pyethash
     ETHASH_LIB = 'pyethash'  # the C++ based implementation
@@ -36,6 +31,9 @@ TT64M1 = 2**64 - 1
 cache_seeds = ['\x00' * 32]
 cache_by_seed = OrderedDict()
 cache_by_seed.max_items = 10
+# Results of check_pow, also filled with results computed by the workers of
+# Chain.import_blocks
+pow_results = LRUCache(1024)
 
 
 def get_cache(block_number):
@@ -53,7 +51,6 @@ def get_cache(block_number):
     return c
 
 
-@lru_cache(maxsize=32)
 def check_pow(block_number, header_hash, mixhash, nonce, difficulty):
     """Check if the proof-of-work of the block is valid.
 
@@ -62,6 +59,19 @@ def check_pow(block_number, header_hash, mixhash, nonce, difficulty):
                   the header
     :returns: `True` or `False`
     """
+    key = (block_number, header_hash, mixhash, nonce, difficulty)
+    result = pow_results.get(key)
+    if result is None:
+        result = _check_pow(*key)
+        add_pow_result(key, result)
+    return result
+
+
+def add_pow_result(key, result):
+    pow_results.put(key, result)
+
+
+def _check_pow(block_number, header_hash, mixhash, nonce, difficulty):
     log.debug('checking pow', block_number=block_number)
     if len(mixhash) != 32 or len(header_hash) != 32 or len(nonce) != 8:
         return False
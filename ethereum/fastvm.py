@@ -1,28 +1,30 @@
-import copy
-import ethereum.opcodes as opcodes
+"""
+VM executing precompiled basic blocks.
+
+Code is split into chunks ending at jumps, calls and other instructions
+that exit, read the remaining gas or the program counter. Every chunk is
+entered only at its start, so the fees and the stack bounds of all its
+instructions are checked once when entering it. As every instruction of a
+chunk is executed unless the execution fails, this gives the same results
+as :func:`ethereum.vm.vm_execute`.
+"""
 #  ####### dev hack flags ###############
 
 verify_stack_after_op = False
 
 #  ######################################
-import sys
+import binascii
 
 from ethereum import utils
-from ethereum.abi import is_numeric
-import copy
 from ethereum import opcodes
-import time
+from ethereum import vm
+from ethereum.code_cache import CodeCache
 from ethereum.slogging import get_logger
-from rlp.utils import encode_hex, ascii_chr
-from ethereum.utils import to_string
-import numpy
+from ethereum.vm import CallData, Message, mem_copy
 
 log_log = get_logger('eth.vm.log')
 log_vm_exit = get_logger('eth.vm.exit')
 log_vm_op = get_logger('eth.vm.op')
-log_vm_op_stack = get_logger('eth.vm.op.stack')
-log_vm_op_memory = get_logger('eth.vm.op.memory')
-log_vm_op_storage = get_logger('eth.vm.op.storage')
 
 TT256 = 2 ** 256
 TT256M1 = 2 ** 256 - 1
@@ -34,54 +36,10 @@ for op in opcodes.opcodes:
 INVALID = -1
 
 
-class CallData(object):
-
-    def __init__(self, parent_memory, offset=0, size=None):
-        self.data = parent_memory
-        self.offset = offset
-        self.size = len(self.data) if size is None else size
-        self.rlimit = self.offset + self.size
-
-    def extract_all(self):
-        d = self.data[self.offset: self.offset + self.size]
-        d += [0] * (self.size - len(d))
-        return b''.join([ascii_chr(x) for x in d])
-
-    def extract32(self, i):
-        if i >= self.size:
-            return 0
-        o = self.data[self.offset + i: min(self.offset + i + 32, self.rlimit)]
-        return utils.bytearray_to_int(o + [0] * (32 - len(o)))
-
-    def extract_copy(self, mem, memstart, datastart, size):
-        for i in range(min(size, self.size - datastart)):
-            mem[memstart + i] = self.data[self.offset + datastart + i]
-        for i in range(max(0, min(size, self.size - datastart)), size):
-            mem[memstart + i] = 0
-
-
-class Message(object):
-
-    def __init__(self, sender, to, value, gas, data,
-                 depth=0, code_address=None, is_create=False):
-        self.sender = sender
-        self.to = to
-        self.value = value
-        self.gas = gas
-        self.data = data
-        self.depth = depth
-        self.logs = []
-        self.code_address = code_address
-        self.is_create = is_create
-
-    def __repr__(self):
-        return '<Message(to:%s...)>' % self.to[:8]
-
-
 class Compustate():
 
     def __init__(self, **kwargs):
-        self.memory = []
+        self.memory = bytearray()
         self.stack = []
         self.pc = 0
         self.gas = 0
@@ -89,7 +47,8 @@ class Compustate():
             setattr(self, kw, kwargs[kw])
 
 end_breakpoints = [
-    'JUMP', 'JUMPI', 'CALL', 'CALLCODE', 'CREATE', 'SUICIDE', 'STOP', 'RETURN', 'SUICIDE', 'INVALID', 'GAS', 'PC'
+    'JUMP', 'JUMPI', 'CALL', 'CALLCODE', 'DELEGATECALL', 'CREATE', 'SUICIDE',
+    'STOP', 'RETURN', 'INVALID', 'GAS', 'PC'
 ]
 
 start_breakpoints = [
@@ -97,12 +56,14 @@ start_breakpoints = [
 ]
 
 
-# Preprocesses code, and determines which locations are in the middle
-# of pushdata and thus invalid
+# Preprocesses code into chunks, a list with the chunk
+# `(gas, min_stack, max_stack, end, ops)` at the start of every chunk and
+# `None` at all other positions. Push values are kept in the high-order
+# bytes of their op.
 def preprocess_code(code):
     assert isinstance(code, bytes)
     code = memoryview(code).tolist()
-    ops = {}
+    ops = [None] * (len(code) + 33)
     cur_chunk = []
     cc_init_pos = 0
     cc_gas_consumption = 0
@@ -112,7 +73,7 @@ def preprocess_code(code):
     i = 0
     while i < len(code):
         op, in_args, out_args, fee = \
-            copy.copy(opcodes.opcodes.get(code[i], ['INVALID', 0, 0, 0]))
+            opcodes.opcodes.get(code[i], ['INVALID', 0, 0, 0])
         opcode, pushval = code[i], 0
         if op[:4] == 'PUSH':
             for j in range(int(op[4:])):
@@ -121,7 +82,7 @@ def preprocess_code(code):
                 pushval = (pushval << 8) + byte
         i += 1
         if op == 'INVALID':
-            opcode = -1
+            opcode = INVALID
         cc_gas_consumption += fee
         cc_min_req_stack = max(cc_min_req_stack, -cc_stack_change + in_args)
         cc_max_req_stack = min(cc_max_req_stack, 1024 - cc_stack_change + in_args - out_args)
@@ -129,19 +90,21 @@ def preprocess_code(code):
         cur_chunk.append(opcode + (pushval << 8))
         if op in end_breakpoints or i >= len(code) or \
                 opcodes.opcodes.get(code[i], ['INVALID'])[0] in start_breakpoints:
-            ops[cc_init_pos] = [
+            ops[cc_init_pos] = (
                 cc_gas_consumption,
                 cc_min_req_stack,
                 cc_max_req_stack,
-                i
-            ] + cur_chunk
+                i,
+                tuple(cur_chunk)
+            )
             cur_chunk = []
             cc_init_pos = i
             cc_gas_consumption = 0
             cc_stack_change = 0
             cc_min_req_stack = 0
             cc_max_req_stack = 1024
-    ops[i] = (0, 0, 1024, [0], 0)
+    # the end of the code, after a truncated push it lies beyond it
+    del ops[i + 1:]
     return ops
 
 
@@ -162,7 +125,7 @@ def mem_extend(mem, compustate, op, start, sz):
                 return False
             compustate.gas -= memfee
             m_extend = (newsize - oldsize) * 32
-            mem.extend([0] * m_extend)
+            mem.extend(bytearray(m_extend))
     return True
 
 
@@ -185,90 +148,42 @@ def peaceful_exit(cause, gas, data, **kargs):
     log_vm_exit.trace('EXIT', cause=cause, **kargs)
     return 1, gas, data
 
-code_cache = {}
+# analyses of code by preprocess_code, about 30 bytes per byte of code
+code_cache = CodeCache(preprocess_code, 30, name=b'fastvm1')
 
 
 def vm_execute(ext, msg, code):
-    # precompute trace flag
-    # if we trace vm, we're in slow mode anyway
-    trace_vm = log_vm_op.is_active('trace')
+    # tracing works per instruction, leave it to the reference vm
+    if log_vm_op.is_active('trace'):
+        return vm.vm_execute(ext, msg, code)
 
     compustate = Compustate(gas=msg.gas)
     stk = compustate.stack
     mem = compustate.memory
 
-    if code in code_cache:
-        processed_code = code_cache[code]
-    else:
-        processed_code = preprocess_code(code)
-        code_cache[code] = processed_code
-
-    s = time.time()
-    op = None
-    steps = 0
-    _prevop = None  # for trace only
+    processed_code = code_cache.get(code, ext.code_db)
 
     while 1:
-      # print 'op: ', op, time.time() - s
-      # s = time.time()
-      # stack size limit error
-      if compustate.pc not in processed_code:
-          return vm_exception('INVALID START POINT')
+      chunk = processed_code[compustate.pc]
+      if chunk is None:
+          return peaceful_exit('CODE OUT OF RANGE', compustate.gas, [])
 
-      _data = processed_code[compustate.pc]
-      gas, min_stack, max_stack, compustate.pc = _data[:4]
-      ops = _data[4:]
+      gas, min_stack, max_stack, compustate.pc, ops = chunk
 
       # out of gas error
       if gas > compustate.gas:
         return vm_exception('OUT OF GAS')
 
       # insufficient stack error
-      if not (min_stack <= len(compustate.stack) <= max_stack):
+      if not (min_stack <= len(stk) <= max_stack):
         return vm_exception('INCOMPATIBLE STACK LENGTH', min_stack=min_stack,
-                            have=len(compustate.stack), max_stack=max_stack)
+                            have=len(stk), max_stack=max_stack)
 
       # Apply operation
       compustate.gas -= gas
 
       for op in ops:
 
-        if trace_vm:
-            """
-            This diverges from normal logging, as we use the logging namespace
-            only to decide which features get logged in 'eth.vm.op'
-            i.e. tracing can not be activated by activating a sub
-            like 'eth.vm.op.stack'
-            """
-            trace_data = {}
-            trace_data['stack'] = list(map(to_string, list(compustate.stack)))
-            if _prevop in (op_MLOAD, op_MSTORE, op_MSTORE8, op_SHA3, op_CALL,
-                           op_CALLCODE, op_CREATE, op_CALLDATACOPY, op_CODECOPY,
-                           op_EXTCODECOPY):
-                if len(compustate.memory) < 1024:
-                    trace_data['memory'] = \
-                        b''.join([encode_hex(ascii_chr(x)) for x
-                                  in compustate.memory])
-                else:
-                    trace_data['sha3memory'] = \
-                        encode_hex(utils.sha3(''.join([ascii_chr(x) for
-                                              x in compustate.memory])))
-            if _prevop in (op_SSTORE, op_SLOAD) or steps == 0:
-                trace_data['storage'] = ext.log_storage(msg.to)
-            # trace_data['gas'] = to_string(compustate.gas + fee)
-            trace_data['inst'] = op
-            trace_data['pc'] = to_string(compustate.pc - 1)
-            if steps == 0:
-                trace_data['depth'] = msg.depth
-                trace_data['address'] = msg.to
-            trace_data['op'] = op
-            trace_data['steps'] = steps
-            # if op[:4] == 'PUSH':
-            #     trace_data['pushvalue'] = pushval
-            log_vm_op.trace('vm', **trace_data)
-            steps += 1
-            _prevop = op
-
         # Invalid operation
         if op == INVALID:
             return vm_exception('INVALID OP', opcode=op)
@@ -361,7 +276,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG PAYING FOR SHA3')
                 if not mem_extend(mem, compustate, op, s0, s1):
                     return vm_exception('OOG EXTENDING MEMORY')
-                data = b''.join(map(ascii_chr, mem[s0: s0 + s1]))
+                data = bytes(mem[s0: s0 + s1])
                 stk.append(utils.big_endian_to_int(utils.sha3(data)))
             elif op == op_ADDRESS:
                 stk.append(utils.coerce_to_int(msg.to))
@@ -393,11 +308,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 if not data_copy(compustate, size):
                     return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s1 + i < len(code):
-                        mem[start + i] = utils.safe_ord(code[s1 + i])
-                    else:
-                        mem[start + i] = 0
+                mem_copy(mem, start, code, s1, size)
             elif op == op_GASPRICE:
                 stk.append(ext.tx_gasprice)
             elif op == op_EXTCODESIZE:
@@ -412,11 +323,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 if not data_copy(compustate, size):
                     return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s2 + i < len(extcode):
-                        mem[start + i] = utils.safe_ord(extcode[s2 + i])
-                    else:
-                        mem[start + i] = 0
+                mem_copy(mem, start, extcode, s2, size)
         elif op < 0x50:
             if op == op_BLOCKHASH:
                 stk.append(utils.big_endian_to_int(ext.block_hash(stk.pop())))
@@ -437,18 +344,12 @@ def vm_execute(ext, msg, code):
                 s0 = stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                data = 0
-                for c in mem[s0: s0 + 32]:
-                    data = (data << 8) + c
-                stk.append(data)
+                stk.append(int(binascii.hexlify(mem[s0: s0 + 32]), 16))
             elif op == op_MSTORE:
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                v = s1
-                for i in range(31, -1, -1):
-                    mem[s0 + i] = v % 256
-                    v //= 256
+                mem[s0: s0 + 32] = binascii.unhexlify('%064x' % s1)
             elif op == op_MSTORE8:
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 1):
@@ -471,17 +372,17 @@ def vm_execute(ext, msg, code):
                 ext.set_storage_data(msg.to, s0, s1)
             elif op == op_JUMP:
                 compustate.pc = stk.pop()
-                opnew = processed_code[compustate.pc][4] if \
-                    compustate.pc in processed_code else op_STOP
-                if opnew != op_JUMPDEST:
+                dest = processed_code[compustate.pc] if \
+                    compustate.pc < len(processed_code) else None
+                if dest is None or dest[4][0] != op_JUMPDEST:
                     return vm_exception('BAD JUMPDEST')
             elif op == op_JUMPI:
                 s0, s1 = stk.pop(), stk.pop()
                 if s1:
                     compustate.pc = s0
-                    opnew = processed_code[compustate.pc][4] if \
-                        compustate.pc in processed_code else op_STOP
-                    if opnew != op_JUMPDEST:
+                    dest = processed_code[compustate.pc] if \
+                        compustate.pc < len(processed_code) else None
+                    if dest is None or dest[4][0] != op_JUMPDEST:
                         return vm_exception('BAD JUMPDEST')
             elif op == op_PC:
                 stk.append(compustate.pc - 1)
@@ -520,7 +421,7 @@ def vm_execute(ext, msg, code):
             compustate.gas -= msz * opcodes.GLOGBYTE
             if not mem_extend(mem, compustate, op, mstart, msz):
                 return vm_exception('OOG EXTENDING MEMORY')
-            data = b''.join(map(ascii_chr, mem[mstart: mstart + msz]))
+            data = bytes(mem[mstart: mstart + msz])
             ext.log(msg.to, topics, data)
             log_log.trace('LOG', to=msg.to, topics=topics, data=list(map(utils.safe_ord, data)))
             # print('LOG', msg.to, topics, list(map(ord, data)))
@@ -565,14 +466,18 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
-        elif op == op_CALLCODE:
-            gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
-                stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+        elif op == op_CALLCODE or op == op_DELEGATECALL:
+            if op == op_CALLCODE:
+                gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
+                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+            else:
+                gas, to, meminstart, meminsz, memoutstart, memoutsz = \
+                    stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+                value = 0
             if not mem_extend(mem, compustate, op, meminstart, meminsz) or \
                     not mem_extend(mem, compustate, op, memoutstart, memoutsz):
                 return vm_exception('OOG EXTENDING MEMORY')
@@ -585,16 +490,21 @@ def vm_execute(ext, msg, code):
                 to = utils.encode_int(to)
                 to = ((b'\x00' * (32 - len(to))) + to)[12:]
                 cd = CallData(mem, meminstart, meminsz)
-                call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
-                                   msg.depth + 1, code_address=to)
+                if ext.post_homestead_hardfork() and op == op_DELEGATECALL:
+                    call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
+                                       msg.depth + 1, code_address=to, transfers_value=False)
+                elif op == op_DELEGATECALL:
+                    return vm_exception('OPCODE INACTIVE')
+                else:
+                    call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
+                                       msg.depth + 1, code_address=to)
                 result, gas, data = ext.msg(call_msg)
                 if result == 0:
                     stk.append(0)
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """
+    Least recently used cache bounded by the total size of its entries.
+
+    Every entry is put with its size, 1 unless given, so by default the
+    number of entries is bounded. Once the total exceeds `max_size` the
+    least recently used entries are evicted, entries larger than
+    `max_size` are not cached at all. `get` returns `None` for missing
+    entries, so `None` cannot be cached.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value, size = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = (value, size)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size=1):
+        self.discard(key)
+        if size > self.max_size:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def discard(self, key):
+        try:
+            _, size = self.entries.pop(key)
+        except KeyError:
+            return
+        self.size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __repr__(self):
+        return '<%s entries=%d size=%d hits=%d misses=%d>' % \
+            (self.__class__.__name__, len(self.entries), self.size,
+             self.hits, self.misses)
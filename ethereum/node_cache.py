@@ -0,0 +1,34 @@
+from ethereum.lru import LRUCache
+
+# Upper bound for the encoded size of all cached nodes
+DEFAULT_NODE_CACHE_SIZE = 16 * 1024 * 1024
+
+
+def copy_node(node):
+    # Tries modify nodes in place, so nested lists (embedded nodes)
+    # must not be shared with the cache
+    return [copy_node(x) if isinstance(x, list) else x for x in node]
+
+
+class NodeCache(LRUCache):
+
+    """
+    LRU cache of decoded trie nodes, keyed by node hash.
+
+    Every database has its own cache (see `BaseDB.node_cache`), shared by
+    all tries using it, so only nodes the database holds are served.
+    Databases discard nodes they remove. The size is bounded by the total
+    length of the rlp encoded nodes.
+    """
+
+    def __init__(self, max_size=DEFAULT_NODE_CACHE_SIZE):
+        super(NodeCache, self).__init__(max_size)
+
+    def get(self, key):
+        node = super(NodeCache, self).get(key)
+        return None if node is None else copy_node(node)
+
+    def put(self, key, rlpnode, node):
+        if key in self.entries or not isinstance(node, list):
+            return
+        super(NodeCache, self).put(key, copy_node(node), len(rlpnode))
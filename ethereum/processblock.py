@@ -7,6 +7,7 @@ from ethereum import utils
 from ethereum import specials
 from ethereum import bloom
 from ethereum import vm as vm
+from ethereum import fastvm
 from ethereum.exceptions import *
 from ethereum.utils import safe_ord, normalize_address, mk_contract_address
 from ethereum import transactions
@@ -31,9 +32,12 @@ CREATE_CONTRACT_ADDRESS = b''
 
 def verify(block, parent):
     from ethereum import blocks
+    # the new block takes over its header, so it gets a copy
+    header = blocks.BlockHeader(**dict((name, getattr(block.header, name))
+                                       for name, _ in blocks.BlockHeader.fields))
     try:
-        block2 = rlp.decode(rlp.encode(block), blocks.Block,
-                            env=parent.env, parent=parent)
+        block2 = blocks.Block(header, block.get_transactions(), block.uncles,
+                              env=parent.env, parent=parent)
         assert block == block2
         return True
     except blocks.VerificationFailed:
@@ -132,7 +136,7 @@ def apply_transaction(block, tx):
     assert block.get_balance(tx.sender) >= tx.startgas * tx.gasprice
     block.delta_balance(tx.sender, -tx.startgas * tx.gasprice)
     message_gas = tx.startgas - intrinsic_gas
-    message_data = vm.CallData([safe_ord(x) for x in tx.data], 0, len(tx.data))
+    message_data = vm.CallData(tx.data, 0, len(tx.data))
     message = vm.Message(tx.sender, tx.to, tx.value, message_gas, message_data, code_address=tx.to)
 
     # MESSAGE
@@ -171,7 +175,7 @@ def apply_transaction(block, tx):
         block.delta_balance(block.coinbase, tx.gasprice * gas_used)
         block.gas_used += gas_used
         if tx.to:
-            output = b''.join(map(ascii_chr, data))
+            output = bytes(bytearray(data))
         else:
             output = data
         success = 1
@@ -210,6 +214,7 @@ class VMExt():
         self.block_number = block.number
         self.block_difficulty = block.difficulty
         self.block_gas_limit = block.gas_limit
+        self.code_db = block.env.code_db
         self.log = lambda addr, topics, data: \
             block.add_log(Log(addr, topics, data))
         self.tx_origin = tx.sender
@@ -248,6 +253,8 @@ def _apply_msg(ext, msg, code):
     # Main loop
     if msg.code_address in specials.specials:
         res, gas, dat = specials.specials[msg.code_address](ext, msg)
+    elif ext._block.config.get('VM_ENGINE') == 'fastvm':
+        res, gas, dat = fastvm.vm_execute(ext, msg, code)
     else:
         res, gas, dat = vm.vm_execute(ext, msg, code)
     # gas = int(gas)
@@ -287,7 +294,7 @@ def create_contract(ext, msg):
     msg.is_create = True
     # assert not ext.get_code(msg.to)
     code = msg.data.extract_all()
-    msg.data = vm.CallData([], 0, 0)
+    msg.data = vm.CallData(b'', 0, 0)
     snapshot = ext._block.snapshot()
     res, gas, dat = _apply_msg(ext, msg, code)
     assert utils.is_numeric(gas)
@@ -304,7 +311,7 @@ def create_contract(ext, msg):
             if ext._block.number >= ext._block.config['HOMESTEAD_FORK_BLKNUM']:
                 ext._block.revert(snapshot)
                 return 0, 0, b''
-        ext._block.set_code(msg.to, b''.join(map(ascii_chr, dat)))
+        ext._block.set_code(msg.to, bytes(bytearray(dat)))
         return 1, gas, msg.to
     else:
         return 0, gas, b''
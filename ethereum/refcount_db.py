@@ -8,59 +8,147 @@ ZERO_ENCODED = utils.encode_int(0)
 ONE_ENCODED = utils.encode_int(1)
 
 
+class RetentionPolicy(object):
+
+    """
+    Decides which old state a RefcountDB keeps around.
+
+    Nodes that drop out of the state are pruned `keep_last` epochs later,
+    which is also how far back forks can be reverted. With `archive` no
+    node is ever pruned. With a `checkpoint_interval` K the full state of
+    every K-th epoch is kept, i.e. a node is not pruned if it was alive at
+    such an epoch.
+    """
+
+    def __init__(self, keep_last=500, checkpoint_interval=None, archive=False):
+        assert keep_last >= 0
+        assert checkpoint_interval is None or checkpoint_interval > 0
+        self.keep_last = keep_last
+        self.checkpoint_interval = checkpoint_interval
+        self.archive = archive
+
+    @classmethod
+    def from_config(cls, config):
+        mode = config.get('PRUNING_MODE', 'keep_last')
+        keep_last = config.get('PRUNING_KEEP_LAST', 500)
+        if mode == 'archive':
+            return cls(keep_last, archive=True)
+        elif mode == 'keep_last':
+            return cls(keep_last)
+        elif mode == 'checkpoints':
+            return cls(keep_last, config['PRUNING_CHECKPOINT_INTERVAL'])
+        raise ValueError('unknown pruning mode: %r' % mode)
+
+    # Whether a node alive from epoch birth to epoch death - 1 has to be
+    # kept forever
+    def keeps(self, birth, death):
+        if self.archive:
+            return True
+        if self.checkpoint_interval is None:
+            return False
+        k = self.checkpoint_interval
+        return (death - 1) // k * k >= birth
+
+    def __repr__(self):
+        if self.archive:
+            return '<RetentionPolicy archive>'
+        if self.checkpoint_interval is None:
+            return '<RetentionPolicy keep_last=%d>' % self.keep_last
+        return '<RetentionPolicy keep_last=%d checkpoint_interval=%d>' % \
+            (self.keep_last, self.checkpoint_interval)
+
+
 class RefcountDB(BaseDB):
 
-    def __init__(self, db):
+    def __init__(self, db, policy=None):
         self.db = db
         self.journal = []
         self.death_row = []
+        # Write batch of [refcount, value] pairs touched since the last
+        # commit_refcount_changes; repeated touches of the same key only
+        # update the batch and hit the underlying db once, on flush
+        self.batch = {}
+        self.journaled = set()
         try:
             self.kv = self.db.kv
         except:
             self.kv = None
-        self.ttl = 500
+        self.policy = policy or RetentionPolicy()
+        # Chain applies the policy of its config unless one was given
+        self.policy_given = policy is not None
+        # Keys first created since the last commit, their birth epoch is
+        # saved under b:<key> when the policy keeps checkpoints. Kept until
+        # the batch is flushed, so it tells which values are new.
+        self.born = set()
+        # Maximum number of death row entries looked at per cleanup, None
+        # prunes every queued death row at once
+        self.prune_budget = None
+        self._death_row_cache = (None, [])
         self.logging = False
 
+    # Number of epochs before dead nodes are pruned and journals dropped
+    @property
+    def ttl(self):
+        return self.policy.keep_last
+
+    @ttl.setter
+    def ttl(self, value):
+        self.policy.keep_last = value
+
+    # Get the (refcount, value) pair of a key, preferring the write batch
+    def _get_node(self, k):
+        if k in self.batch:
+            return self.batch[k]
+        refcount, value = rlp.decode(self.db.get(b'r:'+k))
+        return [utils.decode_int(refcount), value]
+
+    # Write a (refcount, value) pair to the underlying db
+    def _put_node(self, k, refcount, value):
+        self.db.put(b'r:'+k, rlp.encode([utils.encode_int(refcount), value]))
+
+    # Remove a pruned key from the underlying db
+    def _delete_node(self, k):
+        self.db.delete(b'r:'+k)
+
+    # Only the refcount a key had before its first touch in the batch needs
+    # to be journaled, as reverting restores journal entries last to first
+    def _journal(self, k, refcount):
+        if k not in self.journaled:
+            self.journaled.add(k)
+            self.journal.append([utils.encode_int(refcount), k])
+
     # Increase the reference count associated with a key
     def inc_refcount(self, k, v):
-        # raise Exception("WHY AM I CHANGING A REFCOUNT?!:?")
         try:
-            node_object = rlp.decode(self.db.get(b'r:'+k))
-            refcount = utils.decode_int(node_object[0])
-            self.journal.append([node_object[0], k])
-            if refcount >= DEATH_ROW_OFFSET:
-                refcount = 0
-            new_refcount = utils.encode_int(refcount + 1)
-            self.db.put(b'r:'+k, rlp.encode([new_refcount, v]))
-            if self.logging:
-                sys.stderr.write('increasing %s %r to: %d\n' % (utils.encode_hex(k), v, refcount + 1))
-        except:
-            self.db.put(b'r:'+k, rlp.encode([ONE_ENCODED, v]))
-            self.journal.append([ZERO_ENCODED, k])
-            if self.logging:
-                sys.stderr.write('increasing %s %r to: %d\n' % (utils.encode_hex(k), v, 1))
+            refcount = self._get_node(k)[0]
+        except KeyError:
+            refcount = 0
+            self.born.add(k)
+        self._journal(k, refcount)
+        if refcount >= DEATH_ROW_OFFSET:
+            refcount = 0
+        self.batch[k] = [refcount + 1, v]
+        if self.logging:
+            sys.stderr.write('increasing %s %r to: %d\n' % (utils.encode_hex(k), v, refcount + 1))
 
     put = inc_refcount
 
     # Decrease the reference count associated with a key
     def dec_refcount(self, k):
-        # raise Exception("WHY AM I CHANGING A REFCOUNT?!:?")
-        node_object = rlp.decode(self.db.get(b'r:'+k))
-        refcount = utils.decode_int(node_object[0])
+        refcount, value = self._get_node(k)
         if self.logging:
             sys.stderr.write('decreasing %s to: %d\n' % (utils.encode_hex(k), refcount - 1))
         assert refcount > 0
-        self.journal.append([node_object[0], k])
-        new_refcount = utils.encode_int(refcount - 1)
-        self.db.put(b'r:'+k, rlp.encode([new_refcount, node_object[1]]))
-        if new_refcount == ZERO_ENCODED:
+        self._journal(k, refcount)
+        self.batch[k] = [refcount - 1, value]
+        if refcount == 1:
             self.death_row.append(k)
 
     delete = dec_refcount
 
     def get_refcount(self, k):
         try:
-            o = utils.decode_int(self.db.get(b'r:'+k))[0]
+            o = self._get_node(k)[0]
             if o >= DEATH_ROW_OFFSET:
                 return 0
             return o
@@ -69,86 +157,198 @@ class RefcountDB(BaseDB):
 
     # Get the value associated with a key
     def get(self, k):
-        return rlp.decode(self.db.get(b'r:'+k))[1]
+        return self._get_node(k)[1]
 
-    # Kill nodes that are eligible to be killed, and remove the associated
-    # deathrow record. Also delete old journals.
+    # Journals and death rows are stored as append-only chunks, one per
+    # commit: <prefix> holds the number of chunks and <prefix>:<n> the
+    # rlp list of entries of chunk n
+    def _get_chunk_count(self, prefix):
+        try:
+            return utils.decode_int(self.db.get(prefix))
+        except:
+            return 0
+
+    def _get_chunk(self, prefix, n):
+        try:
+            return rlp.decode(self.db.get(prefix+':'+str(n)))
+        except:
+            return []
+
+    def _append_chunk(self, prefix, entries):
+        n = self._get_chunk_count(prefix)
+        self.db.put(prefix+':'+str(n), rlp.encode(entries))
+        self.db.put(prefix, utils.encode_int(n + 1))
+
+    def _delete_chunks(self, prefix):
+        for n in range(self._get_chunk_count(prefix)):
+            self.db.delete(prefix+':'+str(n))
+        try:
+            self.db.delete(prefix)
+        except:
+            pass
+
+    # Queue the death row of an epoch for pruning and prune as much as the
+    # budget allows. Also delete old journals.
     def cleanup(self, epoch):
+        epochs, chunk, index = self._get_prune_cursor()
+        epochs.append(epoch)
+        self._put_prune_cursor(epochs, chunk, index)
+        # Delete journals that are too old
+        self._delete_chunks('journal:'+str(epoch - self.ttl))
+        self._delete_chunks('births:'+str(epoch - self.ttl))
+        self.prune(self.prune_budget)
+
+    # The prune cursor is the list of queued epochs and the position (chunk
+    # and entry) in the death row of the first one
+    def _get_prune_cursor(self):
         try:
-            death_row_node = self.db.get('deathrow:'+str(epoch))
+            epochs, chunk, index = rlp.decode(self.db.get('deathrow:cursor'))
         except:
-            death_row_node = rlp.encode([])
-        death_row_nodes = rlp.decode(death_row_node)
-        pruned = 0
-        for nodekey in death_row_nodes:
+            return [], 0, 0
+        return ([utils.decode_int(e) for e in epochs],
+                utils.decode_int(chunk), utils.decode_int(index))
+
+    def _put_prune_cursor(self, epochs, chunk, index):
+        if not epochs:
             try:
-                refcount, val = rlp.decode(self.db.get(b'r:'+nodekey))
-                if utils.decode_int(refcount) == DEATH_ROW_OFFSET + epoch:
-                    self.db.delete(b'r:'+nodekey)
-                    pruned += 1
+                self.db.delete('deathrow:cursor')
             except:
                 pass
+            return
+        self.db.put('deathrow:cursor', rlp.encode(
+            [[utils.encode_int(e) for e in epochs], utils.encode_int(chunk),
+             utils.encode_int(index)]))
+
+    # Number of epochs whose death rows are queued for pruning
+    def prune_backlog(self):
+        return len(self._get_prune_cursor()[0])
+
+    def _get_death_row_chunk(self, epoch, chunk):
+        if self._death_row_cache[0] != (epoch, chunk):
+            self._death_row_cache = ((epoch, chunk), self._get_chunk(
+                'deathrow:'+str(epoch), chunk))
+        return self._death_row_cache[1]
+
+    # Kill nodes of queued death rows that are still eligible to be killed,
+    # looking at no more than budget death row entries (all of them if
+    # budget is None). Processed death rows are deleted and the position is
+    # saved, so pruning resumes where it stopped. Returns True once the
+    # queue is empty.
+    def prune(self, budget=None):
+        epochs, chunk, index = self._get_prune_cursor()
+        if not epochs:
+            return True
+        pruned = 0
+        while epochs and (budget is None or budget > 0):
+            epoch = epochs[0]
+            if chunk >= self._get_chunk_count('deathrow:'+str(epoch)):
+                # Delete the deathrow after processing it
+                self._delete_chunks('deathrow:'+str(epoch))
+                self._death_row_cache = (None, [])
+                epochs.pop(0)
+                chunk = index = 0
+                continue
+            death_row_nodes = self._get_death_row_chunk(epoch, chunk)
+            end = len(death_row_nodes)
+            if budget is not None:
+                end = min(end, index + budget)
+                budget -= end - index
+            for nodekey in death_row_nodes[index:end]:
+                try:
+                    refcount, val = self._get_node(nodekey)
+                    if refcount == DEATH_ROW_OFFSET + epoch:
+                        self._delete_node(nodekey)
+                        self._discard_node(nodekey)
+                        self.batch.pop(nodekey, None)
+                        if self.policy.checkpoint_interval is not None:
+                            self._delete_birth(nodekey)
+                        pruned += 1
+                except:
+                    pass
+            index = end
+            if index == len(death_row_nodes):
+                chunk, index = chunk + 1, 0
+        self._put_prune_cursor(epochs, chunk, index)
         sys.stderr.write('%d nodes successfully pruned\n' % pruned)
-        # Delete the deathrow after processing it
+        return not epochs
+
+    # Epoch in which a key was first created, 0 if it predates tracking
+    def _get_birth(self, k, epoch):
+        if k in self.born:
+            return epoch
         try:
-            self.db.delete('deathrow:'+str(epoch))
+            return utils.decode_int(self.db.get(b'b:'+k))
         except:
-            pass
-        # Delete journals that are too old
+            return 0
+
+    def _delete_birth(self, k):
         try:
-            self.db.delete('journal:'+str(epoch - self.ttl))
+            self.db.delete(b'b:'+k)
         except:
             pass
 
     # Commit changes to the journal and death row to the database
     def commit_refcount_changes(self, epoch):
-        # Save death row nodes
+        # Save death row nodes, unless the policy keeps them
         timeout_epoch = epoch + self.ttl
-        try:
-            death_row_nodes = rlp.decode(self.db.get('deathrow:'+str(timeout_epoch)))
-        except:
-            death_row_nodes = []
+        new_death_row = []
         for nodekey in self.death_row:
-            refcount, val = rlp.decode(self.db.get(b'r:'+nodekey))
-            if refcount == ZERO_ENCODED:
-                new_refcount = utils.encode_int(DEATH_ROW_OFFSET + timeout_epoch)
-                self.db.put(b'r:'+nodekey, rlp.encode([new_refcount, val]))
-        if len(self.death_row) > 0:
+            if nodekey in self.batch and self.batch[nodekey][0] == 0:
+                if self.policy.archive:
+                    continue
+                if self.policy.checkpoint_interval is not None and \
+                        self.policy.keeps(self._get_birth(nodekey, epoch), epoch):
+                    continue
+                self.batch[nodekey][0] = DEATH_ROW_OFFSET + timeout_epoch
+                new_death_row.append(nodekey)
+        if len(new_death_row) > 0:
             sys.stderr.write('%d nodes marked for pruning during block %d\n' %
-                             (len(self.death_row), timeout_epoch))
-        death_row_nodes.extend(self.death_row)
+                             (len(new_death_row), timeout_epoch))
+            self._append_chunk('deathrow:'+str(timeout_epoch), new_death_row)
         self.death_row = []
-        self.db.put('deathrow:'+str(timeout_epoch),
-                    rlp.encode(death_row_nodes))
+        # Record when surviving new keys were created, journaled under
+        # births:<epoch> so reverting the epoch removes the records
+        if self.policy.checkpoint_interval is not None:
+            births = [k for k in self.born if self.batch[k][0] > 0]
+            for k in births:
+                self.db.put(b'b:'+k, utils.encode_int(epoch))
+            if births:
+                self._append_chunk('births:'+str(epoch), births)
+        # Flush the write batch
+        for k, (refcount, value) in self.batch.items():
+            self._put_node(k, refcount, value)
+        self.batch = {}
+        self.born = set()
+        self.journaled = set()
         # Save journal
-        try:
-            journal = rlp.decode(self.db.get('journal:'+str(epoch)))
-        except:
-            journal = []
-        journal.extend(self.journal)
+        if self.journal:
+            self._append_chunk('journal:'+str(epoch), self.journal)
         self.journal = []
-        self.db.put('journal:'+str(epoch), rlp.encode(journal))
 
     # Revert changes made during an epoch
     def revert_refcount_changes(self, epoch):
         timeout_epoch = epoch + self.ttl
         # Delete death row additions
-        try:
-            self.db.delete('deathrow:'+str(timeout_epoch))
-        except:
-            pass
-        # Revert journal changes
-        try:
-            journal = rlp.decode(self.db.get('journal:'+str(epoch)))
-            for new_refcount, hashkey in journal[::-1]:
-                node_object = rlp.decode(self.db.get(b'r:'+hashkey))
-                self.db.put(b'r:'+hashkey,
-                            rlp.encode([new_refcount, node_object[1]]))
-        except:
-            pass
+        self._delete_chunks('deathrow:'+str(timeout_epoch))
+        self._death_row_cache = (None, [])
+        # Revert journal changes, last chunk first
+        prefix = 'journal:'+str(epoch)
+        for n in reversed(range(self._get_chunk_count(prefix))):
+            try:
+                for new_refcount, hashkey in self._get_chunk(prefix, n)[::-1]:
+                    value = self._get_node(hashkey)[1]
+                    self.batch[hashkey] = [utils.decode_int(new_refcount), value]
+            except:
+                pass
+        # Remove the birth records of the epoch
+        prefix = 'births:'+str(epoch)
+        for n in range(self._get_chunk_count(prefix)):
+            for k in self._get_chunk(prefix, n):
+                self._delete_birth(k)
+        self._delete_chunks(prefix)
 
     def _has_key(self, key):
-        return b'r:'+key in self.db
+        return key in self.batch or b'r:'+key in self.db
 
     def __contains__(self, key):
         return self._has_key(key)
@@ -159,3 +359,38 @@ class RefcountDB(BaseDB):
 
     def commit(self):
         self.db.commit()
+
+
+class SplitRefcountDB(RefcountDB):
+
+    """
+    RefcountDB with refcounts and values in separate key spaces.
+
+    Values are stored raw under `n:<key>` and refcounts (including death row
+    markers) as fixed-width big endian counters under `c:<key>`, so changing
+    a refcount never rewrites the value and `get` does not decode anything.
+    """
+
+    def _get_node(self, k):
+        if k in self.batch:
+            return self.batch[k]
+        # the value is only loaded when it is actually needed
+        return [utils.big_endian_to_int(self.db.get(b'c:'+k)), None]
+
+    def _put_node(self, k, refcount, value):
+        self.db.put(b'c:'+k, utils.zpad(utils.int_to_big_endian(refcount), 8))
+        # values are content addressed, only new keys need theirs written
+        if value is not None and k in self.born:
+            self.db.put(b'n:'+k, value)
+
+    def _delete_node(self, k):
+        self.db.delete(b'c:'+k)
+        self.db.delete(b'n:'+k)
+
+    def get(self, k):
+        if k in self.batch and self.batch[k][1] is not None:
+            return self.batch[k][1]
+        return self.db.get(b'n:'+k)
+
+    def _has_key(self, key):
+        return key in self.batch or b'c:'+key in self.db
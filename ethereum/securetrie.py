@@ -15,24 +15,35 @@ class SecureTrie(object):
     def get(self, k):
         return self.trie.get(utils.sha3(k))
 
+    def get_many(self, keys):
+        return self.trie.get_many([utils.sha3(k) for k in keys])
+
     def delete(self, k):
         self.trie.delete(utils.sha3(k))
 
     def to_dict(self):
-        o = {}
-        for h, v in list(self.trie.to_dict().items()):
-            k = self.db.get(h)
-            o[k] = v
-        return o
+        return dict(self.iter_branch())
 
-    def iter_branch(self):
-        for h, v in self.trie.iter_branch():
+    def iter_branch(self, start=None, end=None):
+        # bounds and order refer to the hashed keys
+        for h, v in self.trie.iter_branch(start, end):
             k = self.db.get(h)
             yield (k, v)
 
     def root_hash_valid(self):
         return self.trie.root_hash_valid()
 
+    def commit(self):
+        self.trie.commit()
+
+    def bulk_load(self, items):
+        hashed = []
+        for k, v in items:
+            h = utils.sha3(k)
+            self.db.put(h, k)
+            hashed.append((h, v))
+        return self.trie.bulk_load(sorted(hashed))
+
     @property
     def root_hash(self):
         return self.trie.root_hash
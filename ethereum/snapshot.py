@@ -0,0 +1,207 @@
+"""
+Flat snapshots of the account state.
+
+Reading an account from the state trie costs one db read and node decode
+per trie level. A snapshot tree instead answers account and storage reads
+for recent state roots from flat dicts:
+
+- the disk layer is a flat `address -> account rlp` and
+  `address -> {slot: value}` store of the state at one root. It is filled
+  lazily with values read from the trie by callers that missed, so it never
+  has to be generated from the whole trie.
+- every committed state change adds a diff layer on top of the layer of the
+  state root it started from, holding only the accounts and storage slots
+  written. A lookup walks from the layer of the requested root down to the
+  disk layer.
+
+Once there are more than `max_layers` diff layers the oldest one on the
+path to the newest layer is merged into the disk layer. Layers that then no
+longer lead to the disk layer (forks from before it) are dropped, reads for
+their roots fall back to the trie.
+"""
+
+# Default number of diff layers kept above the disk layer
+DEFAULT_MAX_LAYERS = 128
+# Default maximum number of accounts and storage slots in the disk layer
+DEFAULT_MAX_ENTRIES = 1000000
+
+
+class DiskLayer(object):
+
+    def __init__(self, root, max_entries=DEFAULT_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self.accounts = {}
+        self.storage = {}
+        self.entries = 0
+
+    def account(self, address):
+        return self.accounts.get(address)
+
+    def storage_value(self, address, index):
+        return self.storage.get(address, {}).get(index)
+
+    def _reserve(self):
+        # the disk layer only caches trie contents, so it can just be
+        # emptied when it grows too large
+        if self.entries >= self.max_entries:
+            self.accounts = {}
+            self.storage = {}
+            self.entries = 0
+        self.entries += 1
+
+    def fill_account(self, address, rlpdata):
+        if address not in self.accounts:
+            self._reserve()
+        self.accounts[address] = rlpdata
+
+    def fill_storage(self, address, index, value):
+        slots = self.storage.get(address)
+        if slots is None or index not in slots:
+            self._reserve()
+            slots = self.storage.setdefault(address, {})
+        slots[index] = value
+
+    def merge(self, diff):
+        """Apply the changes of a diff layer directly above this layer."""
+        for address in diff.destructs:
+            self.entries -= len(self.storage.pop(address, {}))
+        for address, rlpdata in diff.accounts.items():
+            self.fill_account(address, rlpdata)
+        for address, slots in diff.storage.items():
+            for index, value in slots.items():
+                self.fill_storage(address, index, value)
+        self.root = diff.root
+
+
+class DiffLayer(object):
+
+    """
+    The changes that lead from the state of `parent` to `root`.
+
+    :ivar accounts: `address -> account rlp` (`b''` for deleted accounts)
+    :ivar storage: `address -> {slot: value}`, 0 for deleted slots
+    :ivar destructs: addresses whose storage was wiped before `storage` was
+                     written
+    """
+
+    def __init__(self, parent, root, accounts, storage, destructs):
+        self.parent = parent
+        self.root = root
+        self.accounts = accounts
+        self.storage = storage
+        self.destructs = destructs
+
+    def account(self, address):
+        layer = self
+        while isinstance(layer, DiffLayer):
+            if address in layer.accounts:
+                return layer.accounts[address]
+            layer = layer.parent
+        return layer.account(address)
+
+    def storage_value(self, address, index):
+        layer = self
+        while isinstance(layer, DiffLayer):
+            slots = layer.storage.get(address)
+            if slots and index in slots:
+                return slots[index]
+            if address in layer.destructs:
+                return 0
+            layer = layer.parent
+        return layer.storage_value(address, index)
+
+
+class SnapshotTree(object):
+
+    """
+    Diff layers over a disk layer, indexed by state root.
+
+    `account` and `storage_value` return `None` if the snapshot cannot
+    answer, either because the root is unknown or because the value is not
+    in the disk layer. In the latter case the caller reads the trie and
+    hands the value back with `fill_account` or `fill_storage`.
+    """
+
+    def __init__(self, max_layers=DEFAULT_MAX_LAYERS,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_layers = max_layers
+        self.max_entries = max_entries
+        self.base = DiskLayer(None, max_entries)
+        self.layers = {}
+
+    def __contains__(self, root):
+        return root in self.layers or root == self.base.root
+
+    def _layer(self, root):
+        if root == self.base.root:
+            return self.base
+        return self.layers.get(root)
+
+    def account(self, root, address):
+        layer = self._layer(root)
+        if layer is None:
+            return None
+        return layer.account(address)
+
+    def storage_value(self, root, address, index):
+        layer = self._layer(root)
+        if layer is None:
+            return None
+        return layer.storage_value(address, index)
+
+    # A value that was not found below root is the same in the disk layer
+    def fill_account(self, root, address, rlpdata):
+        if root in self:
+            self.base.fill_account(address, rlpdata)
+
+    def fill_storage(self, root, address, index, value):
+        if root in self:
+            self.base.fill_storage(address, index, value)
+
+    def update(self, parent_root, root, accounts, storage, destructs):
+        """Add the diff layer of a state change from `parent_root` to
+        `root`."""
+        if root in self or root == parent_root:
+            # roots identify states, so a known root needs no new layer
+            return
+        parent = self._layer(parent_root)
+        if parent is None:
+            # unrelated to the known layers, start over from parent_root
+            self.base = DiskLayer(parent_root, self.max_entries)
+            self.layers = {}
+            parent = self.base
+        layer = DiffLayer(parent, root, accounts, storage, destructs)
+        self.layers[root] = layer
+        if len(self.layers) > self.max_layers:
+            self.cap(layer)
+
+    def cap(self, head):
+        """Merge the bottom diff layer below `head` into the disk layer."""
+        bottom = head
+        while bottom.parent is not self.base:
+            bottom = bottom.parent
+        self.base.merge(bottom)
+        del self.layers[bottom.root]
+        dropped = set()
+        for layer in self.layers.values():
+            if layer.parent is bottom:
+                layer.parent = self.base
+            elif layer.parent is self.base:
+                dropped.add(layer)
+        while dropped:
+            for layer in dropped:
+                del self.layers[layer.root]
+            dropped = set(layer for layer in self.layers.values()
+                          if layer.parent in dropped)
+
+    def clear(self):
+        self.base = DiskLayer(None, self.max_entries)
+        self.layers = {}
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __repr__(self):
+        return '<SnapshotTree layers=%d entries=%d>' % \
+            (len(self.layers), self.base.entries)
@@ -1,10 +1,9 @@
 # -*- coding: utf8 -*-
 import bitcoin
-from rlp.utils import ascii_chr
 from secp256k1 import PublicKey, ALL_FLAGS
 
 from ethereum import utils, opcodes
-from ethereum.utils import safe_ord, decode_hex
+from ethereum.utils import decode_hex
 
 
 ZERO_PRIVKEY_ADDR = decode_hex('3f17f1962b36e491b30a40b2405849e597ba5fb5')
@@ -17,9 +16,7 @@ def proc_ecrecover(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
 
-    message_hash_bytes = [0] * 32
-    msg.data.extract_copy(message_hash_bytes, 0, 0, 32)
-    message_hash = b''.join(map(ascii_chr, message_hash_bytes))
+    message_hash = msg.data.extract(0, 32)
 
     # TODO: This conversion isn't really necessary.
     # TODO: Invesitage if the check below is really needed.
@@ -30,10 +27,7 @@ def proc_ecrecover(ext, msg):
     if r >= bitcoin.N or s >= bitcoin.N or v < 27 or v > 28:
         return 1, msg.gas - opcodes.GECRECOVER, []
 
-    signature_bytes = [0] * 64
-    msg.data.extract_copy(signature_bytes, 0, 64, 32)
-    msg.data.extract_copy(signature_bytes, 32, 96, 32)
-    signature = b''.join(map(ascii_chr, signature_bytes))
+    signature = msg.data.extract(64, 64)
 
     pk = PublicKey(flags=ALL_FLAGS)
     try:
@@ -50,7 +44,7 @@ def proc_ecrecover(ext, msg):
         return 1, msg.gas - gas_cost, []
 
     pub = pk.serialize(compressed=False)
-    o = [0] * 12 + [safe_ord(x) for x in utils.sha3(pub[1:])[-20:]]
+    o = b'\x00' * 12 + utils.sha3(pub[1:])[-20:]
     return 1, msg.gas - gas_cost, o
 
 
@@ -62,7 +56,7 @@ def proc_sha256(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
     d = msg.data.extract_all()
-    o = [safe_ord(x) for x in bitcoin.bin_sha256(d)]
+    o = bitcoin.bin_sha256(d)
     return 1, msg.gas - gas_cost, o
 
 
@@ -74,7 +68,7 @@ def proc_ripemd160(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
     d = msg.data.extract_all()
-    o = [0] * 12 + [safe_ord(x) for x in bitcoin.ripemd.RIPEMD160(d).digest()]
+    o = b'\x00' * 12 + bitcoin.ripemd.RIPEMD160(d).digest()
     return 1, msg.gas - gas_cost, o
 
 
@@ -85,8 +79,7 @@ def proc_identity(ext, msg):
     gas_cost = OP_GAS
     if msg.gas < gas_cost:
         return 0, 0, []
-    o = [0] * msg.data.size
-    msg.data.extract_copy(o, 0, 0, len(o))
+    o = msg.data.extract_all()
     return 1, msg.gas - gas_cost, o
 
 specials = {
@@ -0,0 +1,221 @@
+"""
+Speculative parallel execution of the transactions of a block.
+
+All transactions of a block are first executed in worker processes against
+the state the block starts from, recording the state each one reads and the
+state it writes. They are then committed in block order in this process:
+a transaction whose reads still see the same values in the state left by
+the transactions before it would have the same effect if it was executed
+there, so its writes are applied directly. Every other transaction is
+executed again sequentially. The resulting state is identical to the one of
+sequential execution.
+
+Fees paid to the coinbase would make every transaction conflict with all
+the others, so positive balance changes of the coinbase are recorded as a
+delta instead of a read and a write. A transaction that reads the balance
+of the coinbase in any other way is executed again, as are transactions
+causing suicides.
+
+The workers are forked from this process and read the state from their
+copy of the database, so this needs a database that can be shared with
+forked processes.
+"""
+from rlp.utils import decode_hex
+from ethereum import processblock, utils
+from ethereum.blocks import Block
+from ethereum.slogging import get_logger
+
+log = get_logger('eth.speculative')
+
+# Blocks with fewer transactions are executed sequentially, as starting the
+# worker processes costs more than it saves
+MIN_PARALLEL_TRANSACTIONS = 16
+# Cache of a speculative block holding the pending delta of the coinbase
+COINBASE_DELTA = 'coinbase_delta'
+
+# (block, transactions) being executed, inherited by the forked workers
+_speculation = None
+
+
+class SpeculativeBlock(Block):
+
+    """
+    A block executing single transactions against its initial state.
+
+    Instead of committing the state changes of a transaction they are kept
+    together with the values of all state it read from the initial state.
+    """
+
+    def start_transaction(self):
+        self.reset_cache()
+        self.caches[COINBASE_DELTA] = {}
+        self.gas_used = 0
+        self.refunds = 0
+        self.logs = []
+        self.suicides = []
+        # (kind, address[, index]) -> the value read from the initial state
+        self.reads = {}
+        self.result = None
+        # set if the transaction has to be executed sequentially
+        self.unsafe = False
+        self._recording = True
+
+    def _read(self, key, value):
+        if self._recording and key not in self.reads:
+            self.reads[key] = value
+
+    def _get_acct_item(self, address, param):
+        if len(address) == 40:
+            address = decode_hex(address)
+        if address in self.caches[param]:
+            return self.caches[param][address]
+        if param == 'balance' and address == self.coinbase:
+            self.unsafe = True
+        value = super(SpeculativeBlock, self)._get_acct_item(address, param)
+        self._read((param, address), value)
+        return value
+
+    def delta_balance(self, address, value):
+        if len(address) == 40:
+            address = decode_hex(address)
+        if address == self.coinbase and value >= 0:
+            delta = self.caches[COINBASE_DELTA].get(address, 0)
+            self.set_and_journal(COINBASE_DELTA, address, delta + value)
+            return True
+        return super(SpeculativeBlock, self).delta_balance(address, value)
+
+    def get_storage_data(self, address, index):
+        if len(address) == 40:
+            address = decode_hex(address)
+        if index in self.caches.get(b'storage:' + address, {}) or \
+                self.caches['storage'].get(address) == b'':
+            # written by the transaction itself
+            return super(SpeculativeBlock, self).get_storage_data(address, index)
+        # the storage root read on the way depends on other slots, the slot
+        # value alone is what matters
+        self._recording = False
+        try:
+            value = super(SpeculativeBlock, self).get_storage_data(address, index)
+        finally:
+            self._recording = True
+        self._read(('slot', address, index), value)
+        return value
+
+    def account_exists(self, address):
+        if len(address) == 40:
+            address = decode_hex(address)
+        if address == self.coinbase:
+            self.unsafe = True
+        if address in self.caches['all']:
+            return True
+        value = super(SpeculativeBlock, self).account_exists(address)
+        self._read(('exists', address), value)
+        return value
+
+    def commit_state(self):
+        if self.result is None:
+            writes = {}
+            for cache, index, _, _ in self.journal:
+                writes[cache, index] = self.caches[cache][index]
+            coinbase_delta = writes.pop((COINBASE_DELTA, self.coinbase), 0)
+            if ('balance', self.coinbase) in writes or self.suicides:
+                self.unsafe = True
+            logs = [(l.address, l.topics, l.data) for l in self.logs]
+            self.result = writes, coinbase_delta, logs
+            # suicides would be applied to the state right away
+            self.suicides = []
+        self.reset_cache()
+
+    def add_transaction_to_list(self, tx):
+        pass
+
+
+def _init_worker():
+    # the forked block is private to this process
+    _speculation[0].__class__ = SpeculativeBlock
+
+
+def _speculate(i):
+    block, transactions = _speculation
+    block.start_transaction()
+    try:
+        success, output = processblock.apply_transaction(block, transactions[i])
+    except Exception:
+        # e.g. a nonce only valid after earlier transactions of the block
+        return None
+    if block.unsafe:
+        return None
+    writes, coinbase_delta, logs = block.result
+    return block.reads, writes, coinbase_delta, block.gas_used, logs
+
+
+def speculate(block, transactions, processes=None):
+    """Execute transactions in parallel against the current state of
+    `block` without changing it.
+
+    :returns: a list with the reads and writes of every transaction, `None`
+              for transactions that have to be executed sequentially
+    """
+    global _speculation
+    _speculation = (block, transactions)
+    try:
+        with utils.worker_pool(processes, _init_worker) as pool:
+            if pool is None:
+                log.debug('speculative execution failed')
+                return [None] * len(transactions)
+            return pool.map(_speculate, range(len(transactions)))
+    finally:
+        _speculation = None
+
+
+def _reads_valid(block, reads):
+    for key, value in reads.items():
+        if key[0] == 'slot':
+            current = block.get_storage_data(key[1], key[2])
+        elif key[0] == 'exists':
+            current = block.account_exists(key[1])
+        else:
+            current = block._get_acct_item(key[1], key[0])
+        if current != value:
+            return False
+    return True
+
+
+def _commit(block, tx, result):
+    # the same steps as processblock.apply_transaction
+    reads, writes, coinbase_delta, gas_used, logs = result
+    processblock.validate_transaction(block, tx)
+    for (cache, index), value in writes.items():
+        if cache not in block.caches:
+            block.caches[cache] = {}
+        block.set_and_journal(cache, index, value)
+    block.delta_balance(block.coinbase, coinbase_delta)
+    block.gas_used += gas_used
+    for address, topics, data in logs:
+        block.add_log(processblock.Log(address, topics, data))
+    block.commit_state()
+    block.add_transaction_to_list(tx)
+    block.logs = []
+
+
+def apply_transactions(block, transactions, processes=None):
+    """Apply transactions to a block like sequential calls of
+    :func:`processblock.apply_transaction` would.
+
+    :param processes: the number of worker processes, `None` for one per cpu
+    :returns: the number of transactions that were executed sequentially
+    """
+    if len(transactions) < MIN_PARALLEL_TRANSACTIONS:
+        results = [None] * len(transactions)
+    else:
+        results = speculate(block, transactions, processes)
+    sequential = 0
+    for tx, result in zip(transactions, results):
+        if result is None or block.refunds or not _reads_valid(block, result[0]):
+            processblock.apply_transaction(block, tx)
+            sequential += 1
+        else:
+            _commit(block, tx, result)
+    log.debug('applied transactions', num=len(transactions),
+              sequential=sequential)
+    return sequential
@@ -0,0 +1,36 @@
+from ethereum.lru import LRUCache
+
+# Upper bound for the size of all cached accounts and code
+DEFAULT_STATE_CACHE_SIZE = 16 * 1024 * 1024
+# Rough size of a cached account on top of its rlp
+ACCOUNT_OVERHEAD = 200
+
+
+class StateCache(LRUCache):
+
+    """
+    LRU cache of decoded accounts and of contract code.
+
+    Accounts are keyed by their rlp encoding and code by its hash. Both are
+    content addressed, so entries stay valid for every state root and are
+    shared by all blocks using the cache, children inherit what their
+    parents decoded. Which rlp an address has at a given root is answered
+    by the state snapshots. The size is bounded by the total length of the
+    cached rlps and code.
+    """
+
+    def __init__(self, max_size=DEFAULT_STATE_CACHE_SIZE):
+        super(StateCache, self).__init__(max_size)
+
+    def get_account(self, rlpdata):
+        """The `(nonce, balance, storage, code_hash)` of an account rlp."""
+        return self.get((b'a', rlpdata))
+
+    def put_account(self, rlpdata, fields):
+        self.put((b'a', rlpdata), fields, len(rlpdata) + ACCOUNT_OVERHEAD)
+
+    def get_code(self, code_hash):
+        return self.get((b'c', code_hash))
+
+    def put_code(self, code_hash, code):
+        self.put((b'c', code_hash), code, len(code) + len(code_hash))
@@ -0,0 +1,72 @@
+"""Disk usage and import speed of the pruning retention policies.
+
+Simulates importing blocks that each update a random set of accounts of a
+secure trie over a RefcountDB, committing and cleaning up per block like
+Chain.add_block does, and reports the final db size and blocks/sec for
+every policy:
+
+    python benchmark_pruning.py --blocks 2000 --json pruning.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from ethereum import utils
+from ethereum import pruning_trie
+from ethereum.db import EphemDB
+from ethereum.refcount_db import RefcountDB, RetentionPolicy
+from ethereum.securetrie import SecureTrie
+
+
+def policies(keep_last, checkpoint_interval):
+    return [('archive', RetentionPolicy(keep_last, archive=True)),
+            ('keep_last', RetentionPolicy(keep_last)),
+            ('checkpoints', RetentionPolicy(keep_last, checkpoint_interval))]
+
+
+def run(name, policy, blocks, accounts, per_block, seed=0):
+    rand = random.Random(seed)
+    db = RefcountDB(EphemDB(), policy)
+    t = SecureTrie(pruning_trie.Trie(db))
+    start = time.time()
+    for n in range(blocks):
+        for i in rand.sample(range(accounts), per_block):
+            t.update(utils.int_to_big_endian(i), utils.sha3(str(n) + str(i)))
+        t.root_hash
+        db.commit_refcount_changes(n)
+        db.cleanup(n)
+    elapsed = time.time() - start
+    return dict(policy=name, blocks=blocks, seconds=elapsed,
+                blocks_per_sec=blocks / elapsed if elapsed else None,
+                db_keys=len(db.kv),
+                db_bytes=sum(len(k) + len(v) for k, v in db.kv.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='pruning policy benchmark')
+    parser.add_argument('--blocks', type=int, default=1000)
+    parser.add_argument('--accounts', type=int, default=10000)
+    parser.add_argument('--per-block', type=int, default=50)
+    parser.add_argument('--keep-last', type=int, default=64)
+    parser.add_argument('--checkpoint-interval', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+    results = []
+    row = '%-12s %8s %12s %10s %12s'
+    print(row % ('policy', 'blocks', 'blocks/sec', 'keys', 'bytes'))
+    for name, policy in policies(args.keep_last, args.checkpoint_interval):
+        r = run(name, policy, args.blocks, args.accounts, args.per_block,
+                args.seed)
+        results.append(r)
+        print(row % (name, r['blocks'], '%.1f' % r['blocks_per_sec'],
+                     r['db_keys'], r['db_bytes']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(python=sys.version, args=vars(args),
+                           results=results), f, indent=1, sort_keys=True)
+    return results
+
+if __name__ == '__main__':
+    main()
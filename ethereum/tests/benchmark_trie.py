@@ -0,0 +1,226 @@
+"""Micro benchmarks for the trie implementations.
+
+Every workload runs on a fresh trie filled with the same deterministic keys
+and reports ops/sec, reads and writes hitting the underlying db, sha3 calls
+and memory growth. Results are printed as a table and can be written as
+JSON to compare runs:
+
+    python benchmark_trie.py --sizes 1000 10000 --json before.json
+"""
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+from ethereum import utils
+from ethereum import trie, pruning_trie
+from ethereum.db import BaseDB, EphemDB
+from ethereum.refcount_db import RefcountDB
+from ethereum.securetrie import SecureTrie
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class CountingDB(BaseDB):
+
+    def __init__(self):
+        self.db = EphemDB()
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, key):
+        self.reads += 1
+        return self.db.get(key)
+
+    def put(self, key, value):
+        self.writes += 1
+        self.db.put(key, value)
+
+    def delete(self, key):
+        self.writes += 1
+        self.db.delete(key)
+
+    def commit(self):
+        pass
+
+    def _has_key(self, key):
+        return key in self.db
+
+    def __contains__(self, key):
+        return key in self.db
+
+    def inc_refcount(self, key, value):
+        self.put(key, value)
+
+    def dec_refcount(self, key):
+        pass
+
+    def commit_refcount_changes(self, epoch):
+        pass
+
+    def cleanup(self, epoch):
+        pass
+
+    def put_temporarily(self, key, value):
+        self.put(key, value)
+
+
+def make_trie(kind, counter):
+    if kind == 'trie':
+        return trie.Trie(counter)
+    if kind == 'pruning_trie':
+        return pruning_trie.Trie(RefcountDB(counter))
+    if kind == 'secure_trie':
+        return SecureTrie(pruning_trie.Trie(RefcountDB(counter)))
+    raise ValueError(kind)
+
+
+def flush(t):
+    # make the refcount db write its batch so db writes are counted
+    t.db.commit_refcount_changes(0)
+
+
+def random_keys(size):
+    return [utils.sha3(utils.int_to_big_endian(i)) for i in range(size)]
+
+
+def sequential_keys(size):
+    return [utils.zpad(utils.int_to_big_endian(i), 32) for i in range(size)]
+
+
+def fill(t, keys):
+    for k in keys:
+        t.update(k, k)
+    t.root_hash
+    flush(t)
+
+
+def proof_key(t, key):
+    # SecureTrie has no proofs of its own
+    if isinstance(t, SecureTrie):
+        return t.trie, utils.sha3(key)
+    return t, key
+
+
+# workloads return the number of operations done
+def insert_random(t, keys, rand):
+    fill(t, keys)
+    return len(keys)
+
+
+def insert_sequential(t, keys, rand):
+    fill(t, sequential_keys(len(keys)))
+    return len(keys)
+
+
+def get(t, keys, rand):
+    for k in rand.sample(keys, min(len(keys), 10000)):
+        t.get(k)
+    return min(len(keys), 10000)
+
+
+def delete(t, keys, rand):
+    keys = rand.sample(keys, len(keys) // 2)
+    for k in keys:
+        t.delete(k)
+    t.root_hash
+    flush(t)
+    return len(keys)
+
+
+def iterate(t, keys, rand):
+    return sum(1 for _ in t.iter_branch())
+
+
+def proof(t, keys, rand):
+    for k in rand.sample(keys, min(len(keys), 1000)):
+        pt, pk = proof_key(t, k)
+        pt.produce_spv_proof(pk)
+    return min(len(keys), 1000)
+
+
+def root_hash(t, keys, rand):
+    # update a tenth of the keys without hashing, then hash once
+    t = t.__class__(t.db, t.root_hash, deferred=True)
+    for k in rand.sample(keys, len(keys) // 10):
+        t.update(k, utils.sha3(k))
+    t.root_hash
+    flush(t)
+    return len(keys) // 10
+
+WORKLOADS = [insert_random, insert_sequential, get, delete, iterate, proof,
+             root_hash]
+PREFILLED = (get, delete, iterate, proof, root_hash)
+TRIES = ['trie', 'pruning_trie', 'secure_trie']
+
+
+def maxrss():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(kind, workload, size, seed=0):
+    rand = random.Random(seed)
+    keys = random_keys(size)
+    counter = CountingDB()
+    t = make_trie(kind, counter)
+    if workload in PREFILLED:
+        fill(t, keys)
+    if workload is root_hash:
+        t = t.trie if isinstance(t, SecureTrie) else t
+    t.db.node_cache.clear()
+    counter.reads = counter.writes = 0
+    sha3_count = utils.sha3_count[0]
+    rss = maxrss()
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    ops = workload(t, keys, rand)
+    elapsed = time.time() - start
+    alloc = None
+    if tracemalloc:
+        alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return dict(trie=kind, workload=workload.__name__, size=size, ops=ops,
+                seconds=elapsed, ops_per_sec=ops / elapsed if elapsed else None,
+                db_reads=counter.reads, db_writes=counter.writes,
+                sha3_calls=utils.sha3_count[0] - sha3_count,
+                alloc_bytes=alloc, maxrss_growth_bytes=maxrss() - rss)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='trie micro benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--tries', nargs='+', default=TRIES, choices=TRIES)
+    parser.add_argument('--workloads', nargs='+',
+                        default=[w.__name__ for w in WORKLOADS],
+                        choices=[w.__name__ for w in WORKLOADS])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+    workloads = [w for w in WORKLOADS if w.__name__ in args.workloads]
+    results = []
+    row = '%-13s %-18s %8s %8s %12s %10s %10s %10s'
+    sys.stderr.write(row % ('trie', 'workload', 'size', 'ops', 'ops/sec',
+                            'reads', 'writes', 'sha3') + '\n')
+    for size in args.sizes:
+        for kind in args.tries:
+            for workload in workloads:
+                r = run(kind, workload, size, args.seed)
+                results.append(r)
+                sys.stderr.write(row % (
+                    kind, r['workload'], size, r['ops'],
+                    '%.1f' % r['ops_per_sec'] if r['ops_per_sec'] else '-',
+                    r['db_reads'], r['db_writes'], r['sha3_calls']) + '\n')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(python=sys.version, results=results), f,
+                      indent=1, sort_keys=True)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Gas per second of every vm engine running the stress_test workload.
+
+python benchmark_vm.py [blocks] [exponent]
+"""
+from ethereum import tester as t
+from ethereum.slogging import set_level
+from ethereum.tests.stress_test import serpent_code
+import sys
+import time
+
+engines = ['vm', 'fastvm']
+
+
+def benchmark(engine, blocks, exponent):
+    s = t.state()
+    s.env.config['VM_ENGINE'] = engine
+    c = s.abi_contract(serpent_code)
+    rates = []
+    for i in range(blocks):
+        s.mine(1)
+        s.block.gas_limit = 10 ** 9
+        x = time.time()
+        result = c.exp([i for i in range(16)], exponent)
+        rates.append(s.block.gas_used / (time.time() - x))
+    return result, rates
+
+
+if __name__ == '__main__':
+    set_level(None, 'info')
+    t.gas_limit = 100000000
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    exponent = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    results = []
+    for engine in engines:
+        result, rates = benchmark(engine, blocks, exponent)
+        results.append(result)
+        print '%-8s gas/sec per block: %s, mean %d' % (
+            engine, ' '.join('%d' % r for r in rates), sum(rates) / len(rates))
+    assert all(r == results[0] for r in results)
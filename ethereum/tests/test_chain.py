@@ -7,7 +7,9 @@ from rlp.utils import decode_hex, encode_hex
 import ethereum.ethpow as ethpow
 import ethereum.utils as utils
 from ethereum.chain import Chain
+from ethereum.config import default_config
 from ethereum.db import EphemDB
+from ethereum.refcount_db import RefcountDB, RetentionPolicy
 from ethereum.tests.utils import new_db
 
 from ethereum.slogging import get_logger
@@ -496,6 +498,116 @@ def test_add_longer_side_chain(db, alt_db):
     assert chain.head == remote_blocks[-1]
 
 
+def test_import_blocks(db, alt_db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    store_block(blk)
+    remote_blocks = [blk]
+    for i in range(4):
+        tx = get_transaction(nonce=i)
+        blk = mine_next_block(remote_blocks[-1], transactions=[tx])
+        store_block(blk)
+        remote_blocks.append(blk)
+    rlp_blocks = [rlp.encode(x) for x in remote_blocks[1:]]
+
+    L0 = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=alt_db)
+    chain = Chain(env=env(L0.db), genesis=L0)
+    # blocks are only taken from the stream as far as needed
+    consumed = []
+
+    def stream():
+        for i, rlp_block in enumerate(rlp_blocks):
+            consumed.append(i)
+            yield rlp_block
+    # block 3 does not follow block 1
+    del rlp_blocks[1]
+    assert chain.import_blocks(stream(), processes=2, lookahead=1) == 1
+    assert chain.head == remote_blocks[1]
+    assert consumed == [0, 1]
+    rlp_blocks.insert(1, rlp.encode(remote_blocks[2]))
+    # undecodable rlp stops the import like an invalid block
+    assert chain.import_blocks([rlp_blocks[1], b'\xc3\x01\x02', rlp_blocks[2]],
+                               processes=2) == 1
+    assert chain.import_blocks([rlp_blocks[2][:-1]], processes=1) == 0
+    assert chain.head == remote_blocks[2]
+    assert chain.import_blocks(rlp_blocks[2:], processes=2, lookahead=2) == 2
+    assert chain.head == remote_blocks[-1]
+
+
+def test_prune_backlog():
+    k, v, k2, v2 = accounts()
+    alloc = {v: {"balance": utils.denoms.ether * 1}}
+    remote_blocks = [mkquickgenesis(alloc, db=EphemDB())]
+    for i in range(12):
+        tx = get_transaction(nonce=i)
+        remote_blocks.append(mine_next_block(remote_blocks[-1], transactions=[tx]))
+    # blocks are pruned too, uncle validation needs the last 7
+    config = dict(default_config, PRUNING_KEEP_LAST=8)
+    db = RefcountDB(EphemDB())
+    genesis = blocks.genesis(blocks.Env(db, config), start_alloc=alloc,
+                             difficulty=1)
+    chain = Chain(env=genesis.env, genesis=genesis)
+    # far less than a block kills
+    db.prune_budget = 1
+    chain.max_prune_backlog = 2
+    bound = db.prune_budget * (1 + chain.backlog_prune_factor)
+    budgets, deleted = [], []
+    prune, delete_node = db.prune, db._delete_node
+
+    def counting_prune(budget=None):
+        budgets.append(budget)
+        return prune(budget)
+
+    def counting_delete_node(k):
+        deleted.append(k)
+        delete_node(k)
+    db.prune, db._delete_node = counting_prune, counting_delete_node
+    for blk in remote_blocks[1:]:
+        blk = blocks.Block.deserialize(rlp.decode(rlp.encode(blk)), env=chain.env)
+        del budgets[:], deleted[:]
+        assert chain.add_block(blk)
+        # the work of a single block stays bounded however large the backlog
+        assert None not in budgets and sum(budgets) <= bound
+        assert len(deleted) <= bound
+    assert chain.head.hash == remote_blocks[-1].hash
+    assert db.prune_backlog() > chain.max_prune_backlog
+    assert not chain.prune(0)
+    assert db.prune_backlog() > chain.max_prune_backlog
+    # pruning while idle catches up
+    while not chain.prune():
+        pass
+    assert db.prune_backlog() == 0
+
+
+def test_retention_policy():
+    config = dict(default_config, PRUNING_KEEP_LAST=64)
+    db = RefcountDB(EphemDB())
+    chain = Chain(env=blocks.Env(db, config), genesis=mkgenesis(db=db))
+    assert db.policy.keep_last == 64
+    # a policy given to the db is not replaced by the one of the config
+    db = RefcountDB(EphemDB(), RetentionPolicy(archive=True))
+    chain = Chain(env=blocks.Env(db, config), genesis=mkgenesis(db=db))
+    assert db.policy.archive
+
+
+def test_verify(db):
+    k, v, k2, v2 = accounts()
+    blk = mkquickgenesis({v: {"balance": utils.denoms.ether * 1}}, db=db)
+    store_block(blk)
+    tx = get_transaction()
+    blk2 = mine_next_block(blk, transactions=[tx])
+    assert processblock.verify(blk2, blk)
+    # a block that claims to use more gas
+    fields = dict((name, getattr(blk2.header, name))
+                  for name, _ in blocks.BlockHeader.fields)
+    fields.update(gas_used=blk2.gas_used + 1, nonce=b'')
+    bad = blocks.Block(blocks.BlockHeader(**fields), blk2.get_transactions(),
+                       env=blk2.env, making=True)
+    # forget that it was created here, so that it is replayed
+    bad.db.delete(b'validated:' + bad.hash)
+    assert not processblock.verify(bad, blk)
+
+
 def test_reward_uncles(db):
     """
     B0 B1 B2
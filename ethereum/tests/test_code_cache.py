@@ -0,0 +1,77 @@
+import pytest
+from ethereum import chain, code_cache, fastvm, utils, vm
+from ethereum.code_cache import CodeCache
+from ethereum.config import Env
+from ethereum.db import EphemDB
+from ethereum.refcount_db import RefcountDB
+from ethereum.tests.test_vm_interpreters import programs, run
+
+
+def test_entry_sizes():
+    c = CodeCache(list, 9, max_size=3 * 10 * 10)
+    for i in range(5):
+        assert c.get(utils.to_string(i) * 10) == [utils.to_string(i)] * 10
+    # every byte of code counts for byte_size bytes of analysis and itself
+    assert len(c) == 3 and c.size == 300
+
+
+def test_persistence():
+    db = EphemDB()
+    code = b'\x60\x01\x60\x02\x01\x56\x5b'
+    c = CodeCache(vm.preprocess_code, 140, name=b'test')
+    assert c.get(code, db) == vm.preprocess_code(code)
+    # the key includes the python, marshal and opcode table versions
+    key, = db.db.keys()
+    assert key.split(b':')[2] == code_cache.DB_VERSION
+    # a new process reads the analysis from the database
+    c = CodeCache(None, 140, name=b'test')
+    assert c.get(code, db) == vm.preprocess_code(code)
+    # caches without a name are never persisted
+    c = CodeCache(list, 1)
+    c.get(b'abc', db)
+    assert len(db.db) == 1
+    # broken entries are analysed again
+    db.put(key, b'\xff')
+    c = CodeCache(vm.preprocess_code, 140, name=b'test')
+    assert c.get(code, db) == vm.preprocess_code(code)
+
+
+def test_env_code_db():
+    # entries put in a refcounting db would be pruned
+    with pytest.raises(AssertionError):
+        Env(EphemDB(), code_db=RefcountDB(EphemDB()))
+    code_db = EphemDB()
+    code = utils.decode_hex(programs[0][2:].replace(' ', ''))
+    vm.code_cache.clear()
+    # the vm persists in the code db of the env of the block
+    run(code, 'switch', code_db=code_db)
+    assert len(code_db.db) == 1
+    vm.code_cache.clear()
+    run(code, 'switch')
+    assert len(code_db.db) == 1
+    env = Env(RefcountDB(EphemDB()), code_db=code_db)
+    env.config['PRUNING_KEEP_LAST'] = 500
+    c = chain.Chain(env, new_head_cb=lambda b: None)
+    assert c.head_candidate.env.code_db is code_db
+    assert vm.VmExtBase().code_db is None
+
+
+def test_persisted_analyses_execute():
+    codes = [utils.decode_hex(p[2:].replace(' ', '')) for p in programs]
+    expected = dict((code, [run(code, i) for i in ('switch', 'table', 'fastvm')])
+                    for code in codes)
+    caches = vm.code_cache, vm.table_code_cache, fastvm.code_cache
+    db = EphemDB()
+    for i in range(2):
+        # first analysed and persisted, then read from the database
+        for cache in caches:
+            cache.clear()
+        for code in codes:
+            assert [run(code, i, code_db=db)
+                    for i in ('switch', 'table', 'fastvm')] == expected[code]
+    for cache in caches:
+        cache.clear()
+    # the table analyses are made from the persisted vm ones
+    names = [key.split(b':')[1] for key in db.db]
+    assert names.count(b'vm1') == names.count(b'fastvm1') >= len(set(codes))
+    assert len(names) == names.count(b'vm1') + names.count(b'fastvm1')
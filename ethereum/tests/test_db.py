@@ -35,3 +35,36 @@ def test_ephem():
         assert key not in db
         with pytest.raises(KeyError):
             db.get(key)
+
+
+def test_leveldb(tmpdir):
+    pytest.importorskip('leveldb')
+    from ethereum.db import LevelDB
+    path = str(tmpdir.join('leveldb'))
+    db = LevelDB(path)
+    dbs = set([db])
+    for key, value in content.items():
+        db.put(key, value)
+        assert key in db
+        assert db.get(key) == value
+    # buffered writes do not change the hash
+    assert db in dbs
+    db.commit()
+    assert not db.uncommitted
+    for key in content:
+        db.delete(key)
+        assert key not in db
+    # deletes are not visible on disk until the next commit
+    del db
+    db = LevelDB(path)
+    for key, value in content.items():
+        assert db.get(key) == value
+    for key in content:
+        db.delete(key)
+    db.commit()
+    del db
+    db = LevelDB(path)
+    for key in content:
+        assert key not in db
+        with pytest.raises(KeyError):
+            db.get(key)
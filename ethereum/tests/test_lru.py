@@ -0,0 +1,31 @@
+from ethereum.lru import LRUCache
+
+
+def test_lru_eviction():
+    c = LRUCache(max_size=100)
+    for i in range(10):
+        c.put(i, [i], 20)
+    assert c.size == 100 and len(c) == 5
+    assert c.get(0) is None
+    assert c.get(5) == [5]
+    # 5 was used most recently so 6 is evicted first
+    c.put(10, [10], 20)
+    assert 5 in c and 6 not in c
+    assert (c.hits, c.misses) == (1, 1)
+    # putting again replaces the entry and its size
+    c.put(5, [5], 40)
+    assert c.size == 100 and len(c) == 4
+    c.discard(5)
+    assert c.size == 60 and 5 not in c
+    # too big to be cached at all
+    c.put(11, [11], 101)
+    assert 11 not in c and c.size == 60
+    c.clear()
+    assert c.size == 0 and len(c) == 0
+
+
+def test_default_size():
+    c = LRUCache(2)
+    for i in range(3):
+        c.put(i, i)
+    assert len(c) == 2 and c.get(0) is None and c.get(2) == 2
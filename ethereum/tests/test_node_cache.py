@@ -0,0 +1,96 @@
+import ethereum.trie as trie
+import ethereum.pruning_trie as pruning_trie
+from ethereum.db import EphemDB, OverlayDB
+from ethereum.refcount_db import RefcountDB, SplitRefcountDB
+from ethereum.securetrie import SecureTrie
+from ethereum.node_cache import NodeCache
+from ethereum.utils import to_string
+
+
+def test_cached_nodes_are_copies():
+    c = NodeCache()
+    node = [b'a', [b'b', b'c']]
+    c.put(b'k', b'xx', node)
+    node[1][0] = b'd'
+    o = c.get(b'k')
+    assert o == [b'a', [b'b', b'c']]
+    o[1][0] = b'd'
+    assert c.get(b'k') == [b'a', [b'b', b'c']]
+    # sized by the encoded node, cached nodes are kept and only lists cached
+    assert c.size == 2
+    c.put(b'k', b'xxxx', node)
+    c.put(b'e', b'yy', b'embedded')
+    assert c.size == 2 and len(c) == 1
+
+
+def _reopen(t):
+    if isinstance(t, SecureTrie):
+        return SecureTrie(_reopen(t.trie))
+    return t.__class__(t.db, t.root_hash)
+
+
+def test_shared_cache():
+    for t in (trie.Trie(EphemDB()), pruning_trie.Trie(RefcountDB(EphemDB())),
+              SecureTrie(trie.Trie(EphemDB()))):
+        for i in range(200):
+            t.update(to_string(i), to_string(i * 2))
+        expected = t.to_dict()
+        node_cache = t.db.node_cache
+        node_cache.clear()
+        misses = node_cache.misses
+        t2 = _reopen(t)
+        assert t2.to_dict() == expected
+        cold_misses = node_cache.misses - misses
+        assert cold_misses > 0
+        hits = node_cache.hits
+        assert t2.to_dict() == expected
+        assert node_cache.misses - misses == cold_misses
+        assert node_cache.hits > hits
+        # updates must not leak into the cached nodes
+        t2.update(b'1', b'new')
+        assert _reopen(t).to_dict() == expected
+
+
+def test_pruned_nodes_are_not_served():
+    for db in (RefcountDB(EphemDB()), SplitRefcountDB(EphemDB())):
+        db.ttl = 0
+        t = pruning_trie.Trie(db)
+        for i in range(50):
+            t.update(to_string(i), to_string(i))
+        db.commit_refcount_changes(0)
+        db.cleanup(0)
+        old_root = t.root_hash
+        assert pruning_trie.Trie(db, old_root).get(b'7') == b'7'
+        assert old_root in db.node_cache
+        for i in range(50):
+            t.update(to_string(i), b'new')
+        db.commit_refcount_changes(1)
+        db.cleanup(1)
+        assert old_root not in db.node_cache
+        try:
+            pruning_trie.Trie(db, old_root).get(b'7')
+            assert False, 'pruned node was read'
+        except KeyError:
+            pass
+
+
+def test_caches_are_per_db():
+    db = EphemDB()
+    t = trie.Trie(db)
+    t.update(b'a', b'x' * 40)
+    t.update(b'b', b'y' * 40)
+    # nodes only written to an overlay are not found in the db below it
+    overlay = trie.Trie(OverlayDB(db), t.root_hash)
+    overlay.update(b'c', b'z' * 40)
+    assert trie.Trie(overlay.db, overlay.root_hash).get(b'c') == b'z' * 40
+    try:
+        trie.Trie(db, overlay.root_hash).get(b'c')
+        assert False, 'node of the overlay was read'
+    except KeyError:
+        pass
+    # nor in another db
+    assert trie.Trie(db, t.root_hash).get(b'a') == b'x' * 40
+    assert t.root_hash in db.node_cache
+    assert t.root_hash not in EphemDB().node_cache
+    db.delete(t.root_hash)
+    assert t.root_hash not in db.node_cache
@@ -1,6 +1,6 @@
 import ethereum.pruning_trie as pruning_trie
 from ethereum.db import EphemDB
-from ethereum.refcount_db import RefcountDB
+from ethereum.refcount_db import RefcountDB, SplitRefcountDB, RetentionPolicy
 import rlp
 import ethereum.utils as utils
 from ethereum.utils import to_string
@@ -446,6 +446,327 @@ def test_jeff():
     run_test('jeff')
 
 
+def test_write_batch():
+    class CountingDB(EphemDB):
+        puts = 0
+
+        def put(self, key, value):
+            self.puts += 1
+            super(CountingDB, self).put(key, value)
+
+    NODES = 60
+    db = RefcountDB(CountingDB())
+    db.ttl = 0
+    t = pruning_trie.Trie(db)
+    for i in range(NODES):
+        t.update(to_string(i), to_string(i))
+    # nothing reaches the underlying db before the epoch is committed
+    assert db.db.puts == 0
+    assert t.to_dict() == {to_string(i): to_string(i) for i in range(NODES)}
+    db.commit_refcount_changes(0)
+    # one write per surviving or dying node plus a chunk and a chunk count
+    # for each of the journal and the death row
+    assert db.db.puts == len([k for k in db.kv if k.startswith(b'r:')]) + 4
+    db.cleanup(0)
+    check_db_tightness([t], db)
+    for i in range(NODES):
+        t.delete(to_string(i))
+    db.commit_refcount_changes(1)
+    db.cleanup(1)
+    assert len(db.kv) == 0
+
+
+def test_split_layout():
+    class CountingDB(EphemDB):
+        value_puts = []
+        value_gets = 0
+
+        def put(self, key, value):
+            if key.startswith(b'n:'):
+                self.value_puts.append(key[2:])
+            super(CountingDB, self).put(key, value)
+
+        def get(self, key):
+            if key.startswith(b'n:'):
+                self.value_gets += 1
+            return super(CountingDB, self).get(key)
+
+    NODES = 60
+    db = SplitRefcountDB(CountingDB())
+    db.ttl = 0
+    t1 = pruning_trie.Trie(db)
+    for i in range(NODES):
+        t1.update(to_string(i), to_string(i))
+    db.commit_refcount_changes(0)
+    assert len(db.db.value_puts) == len([k for k in db.kv if k.startswith(b'n:')])
+    db.cleanup(0)
+    db.db.value_puts = []
+    nodes = [k[2:] for k in db.kv if k.startswith(b'n:')]
+    for k in nodes:
+        # values are stored raw, refcounts as fixed-width counters
+        assert db.get(k) == db.db.get(b'n:'+k)
+        assert len(db.db.get(b'c:'+k)) == 8
+        assert db.get_refcount(k) >= 1
+    # a second identical trie only bumps refcounts
+    t2 = pruning_trie.Trie(db)
+    for i in range(NODES):
+        t2.update(to_string(i), to_string(i))
+    gets = db.db.value_gets
+    db.commit_refcount_changes(1)
+    db.cleanup(1)
+    assert not set(db.db.value_puts) & set(nodes)
+    # flushing does not read values back to compare them
+    assert db.db.value_gets == gets
+    assert t2.root_hash == t1.root_hash
+    assert t2.to_dict() == t1.to_dict()
+    # reverting an epoch restores the counters
+    refcounts = {k: db.get_refcount(k) for k in nodes}
+    for i in range(NODES):
+        t2.delete(to_string(i))
+    db.commit_refcount_changes(2)
+    db.revert_refcount_changes(2)
+    db.commit_refcount_changes(2)
+    db.cleanup(2)
+    assert {k: db.get_refcount(k) for k in nodes} == refcounts
+    t2 = pruning_trie.Trie(db, t1.root_hash)
+    for t in (t1, t2):
+        for i in range(NODES):
+            t.delete(to_string(i))
+    db.commit_refcount_changes(3)
+    db.cleanup(3)
+    assert len(db.kv) == 0
+
+
+
+def test_deferred_commit():
+    import random
+    rand = random.Random(42)
+    db1, db2 = RefcountDB(EphemDB()), RefcountDB(EphemDB())
+    db1.ttl = db2.ttl = 0
+    t1 = pruning_trie.Trie(db1)
+    t2 = pruning_trie.Trie(db2, deferred=True)
+    keys = [utils.sha3(to_string(i))[:rand.randrange(1, 5)] for i in range(200)]
+    for epoch in range(20):
+        for i in range(rand.randrange(1, 60)):
+            k = rand.choice(keys)
+            if rand.random() < 0.3:
+                t1.delete(k)
+                t2.delete(k)
+            else:
+                v = to_string(rand.randrange(10 ** 6)) * rand.randrange(1, 4)
+                t1.update(k, v)
+                t2.update(k, v)
+        if epoch % 5 == 4:
+            # no refcount changes before the commit
+            assert t2.dirty
+            assert len(db2.batch) == 0
+        t2.commit()
+        assert t2.root_hash == t1.root_hash
+        assert t2.to_dict() == t1.to_dict()
+        for d in (db1, db2):
+            d.commit_refcount_changes(epoch)
+            d.cleanup(epoch)
+        assert db1.kv == db2.kv
+        check_db_tightness([t2], db2)
+    # a trie reopened from its root can carry on
+    t3 = pruning_trie.Trie(db2, t2.root_hash, deferred=True)
+    for k in t3.to_dict():
+        t3.delete(k)
+    assert t3.root_hash == pruning_trie.BLANK_ROOT
+    db2.commit_refcount_changes(20)
+    db2.cleanup(20)
+    assert len([k for k in db2.kv if k.startswith(b'r:')]) == 0
+
+
+
+def test_bulk_load():
+    import random
+    rand = random.Random(1)
+    items = {}
+    for i in range(500):
+        k = utils.sha3(to_string(i))[:rand.randrange(1, 6)]
+        items[k] = to_string(i) * rand.randrange(1, 10)
+    db1, db2 = RefcountDB(EphemDB()), RefcountDB(EphemDB())
+    db1.ttl = db2.ttl = 0
+    t1 = pruning_trie.Trie(db1)
+    for k, v in items.items():
+        t1.update(k, v)
+    t2 = pruning_trie.Trie(db2)
+    assert t2.bulk_load(sorted(items.items())) == t1.root_hash
+    assert t2.to_dict() == items
+    for d in (db1, db2):
+        d.commit_refcount_changes(0)
+        d.cleanup(0)
+    # same refcounts as if the keys had been inserted one by one
+    assert db1.kv == db2.kv
+    check_db_tightness([t2], db2)
+    try:
+        pruning_trie.Trie(EphemDB()).bulk_load([(b'b', b'1'), (b'a', b'2')])
+        assert False
+    except Exception as e:
+        assert 'sorted' in str(e)
+
+
+
+def test_iter_branch():
+    import random
+    rand = random.Random(7)
+    db = RefcountDB(EphemDB())
+    t = pruning_trie.Trie(db)
+    items = {}
+    for i in range(300):
+        k = utils.sha3(to_string(i))[:rand.randrange(0, 4)]
+        items[k] = to_string(i)
+        t.update(k, to_string(i))
+    keys = sorted(items)
+    assert list(t.iter_branch()) == [(k, items[k]) for k in keys]
+    assert list(t) == keys
+    assert t.to_dict() == items
+    for i in range(50):
+        bounds = [utils.sha3(to_string(i * 2 + j))[:rand.randrange(0, 3)]
+                  for j in range(2)]
+        start, end = sorted(bounds)
+        expected = [(k, items[k]) for k in keys if start <= k < end]
+        assert list(t.iter_branch(start, end)) == expected
+        assert list(t.iter_branch(start=start)) == \
+            [(k, items[k]) for k in keys if start <= k]
+        assert list(t.iter_branch(end=end)) == \
+            [(k, items[k]) for k in keys if k < end]
+    assert list(pruning_trie.Trie(db).iter_branch()) == []
+
+
+
+def test_get_many():
+    import random
+    from ethereum.securetrie import SecureTrie
+    rand = random.Random(3)
+    t = pruning_trie.Trie(RefcountDB(EphemDB()))
+    keys = [utils.sha3(to_string(i))[:rand.randrange(0, 4)] for i in range(300)]
+    for i, k in enumerate(keys):
+        t.update(k, to_string(i))
+    queries = keys[::3] + [b'missing', b'', keys[0]] + \
+        [utils.sha3(to_string(i))[:2] for i in range(1000, 1100)]
+    assert t.get_many(queries) == [t.get(k) for k in queries]
+    assert t.get_many([]) == []
+    assert pruning_trie.Trie(EphemDB()).get_many([b'a']) == [b'']
+    st = SecureTrie(t)
+    st.update(b'secure', b'value')
+    assert st.get_many([b'secure', b'other']) == [b'value', b'']
+
+
+
+def test_hex_path():
+    for nibbles in ([], [1], [0, 15], [7, 0, 3], list(range(16))):
+        hex_path = ''.join('%x' % x for x in nibbles)
+        for terminator in (False, True):
+            packed = pruning_trie.pack_nibbles(
+                pruning_trie.adapt_terminator(nibbles, terminator))
+            assert pruning_trie.unpack_to_hex_path(packed) == hex_path
+            node_type = pruning_trie.Trie(EphemDB())._get_node_type(
+                [packed, b'x'])
+            assert node_type == (pruning_trie.NODE_TYPE_LEAF if terminator
+                                 else pruning_trie.NODE_TYPE_EXTENSION)
+
+
+
+def test_incremental_pruning():
+    db = RefcountDB(EphemDB())
+    NODES = 60
+    t = pruning_trie.Trie(db)
+    db.ttl = 0
+    db.prune_budget = 5
+    for i in range(NODES):
+        t.update(to_string(i), to_string(i))
+        db.commit_refcount_changes(i)
+        db.cleanup(i)
+    t.clear_all()
+    db.commit_refcount_changes(NODES)
+    db.cleanup(NODES)
+    assert len(db.kv) > 1
+    assert b'deathrow:cursor' in db.kv
+    # pruning resumes from the saved cursor with a fresh db object
+    db = RefcountDB(db.db)
+    steps = 0
+    while not db.prune(1):
+        steps += 1
+    assert steps > 1
+    assert len(db.kv) == 0
+
+
+def test_chunked_journal():
+    db = RefcountDB(EphemDB())
+    db.ttl = 0
+    t = pruning_trie.Trie(db)
+    t.update(b'base', b'value')
+    db.commit_refcount_changes(0)
+    db.cleanup(0)
+    x = t.root_hash
+    # repeated commits of one epoch each add a chunk instead of rewriting
+    # the whole journal
+    for i in range(20):
+        t.update(to_string(i), to_string(i))
+        db.commit_refcount_changes(1)
+    assert utils.decode_int(db.kv[b'journal:1']) == 20
+    assert utils.decode_int(db.kv[b'deathrow:1']) == 20
+    assert len(rlp.decode(db.kv[b'journal:1:19'])) < 10
+    db.revert_refcount_changes(1)
+    assert b'deathrow:1' not in db.kv
+    db.commit_refcount_changes(1)
+    db.cleanup(1)
+    t.root_hash = x
+    assert t.to_dict() == {b'base': b'value'}
+    assert [k for k in db.kv if not k.startswith(b'r:')] == []
+
+
+def test_retention_policies():
+    sizes = {}
+    for mode, policy in (('archive', RetentionPolicy(0, archive=True)),
+                         ('keep_last', RetentionPolicy(0)),
+                         ('checkpoints', RetentionPolicy(0, 5))):
+        db = RefcountDB(EphemDB(), policy)
+        t = pruning_trie.Trie(db)
+        states = []
+        for i in range(20):
+            for j in range(4):
+                t.update(to_string(j), utils.sha3(to_string(i)))
+            db.commit_refcount_changes(i)
+            states.append([utils.sha3(rlp.encode(nd)) for nd in t.all_nodes()
+                           if len(rlp.encode(nd)) >= 32])
+            db.cleanup(i)
+        kept = [i for i, keys in enumerate(states) if all(k in db for k in keys)]
+        if mode == 'archive':
+            assert kept == list(range(20))
+        elif mode == 'keep_last':
+            assert kept == [19]
+        else:
+            assert kept == [0, 5, 10, 15, 19]
+        sizes[mode] = len([k for k in db.kv if k.startswith(b'r:')])
+    assert sizes['keep_last'] < sizes['checkpoints'] < sizes['archive']
+    assert RetentionPolicy.from_config({'PRUNING_MODE': 'archive'}).archive
+    assert RetentionPolicy.from_config(
+        {'PRUNING_MODE': 'checkpoints', 'PRUNING_KEEP_LAST': 64,
+         'PRUNING_CHECKPOINT_INTERVAL': 1000}).checkpoint_interval == 1000
+
+
+
+def test_revert_births():
+    db = RefcountDB(EphemDB(), RetentionPolicy(2, 5))
+    t = pruning_trie.Trie(db)
+    t.update(b'a', b'1' * 40)
+    db.commit_refcount_changes(0)
+    db.cleanup(0)
+    births = sorted(k for k in db.kv if k.startswith(b'b:'))
+    assert births
+    for i in range(10):
+        t.update(to_string(i), to_string(i) * 40)
+    db.commit_refcount_changes(1)
+    assert len([k for k in db.kv if k.startswith(b'b:')]) > len(births)
+    db.revert_refcount_changes(1)
+    db.commit_refcount_changes(1)
+    db.cleanup(1)
+    assert sorted(k for k in db.kv if k.startswith(b'b:')) == births
+    assert not [k for k in db.kv if k.startswith(b'births:1')]
+
 
 # test_basic_pruning = None
 # test_delayed_pruning = None
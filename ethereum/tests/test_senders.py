@@ -0,0 +1,57 @@
+import multiprocessing
+import rlp
+from ethereum import transactions, utils
+
+
+def test_recover_senders():
+    keys = [utils.sha3(str(i)) for i in range(40)]
+    txs = [transactions.Transaction(i, 1, 21000, b'\x01' * 20, 0, b'').sign(k)
+           for i, k in enumerate(keys)]
+    # a broken signature stays unrecovered
+    txs[3].s = transactions.N
+    min_pool_recovery = transactions.MIN_POOL_RECOVERY
+    # batches without a pool of the caller start their own
+    transactions.MIN_POOL_RECOVERY = 1
+    pool = multiprocessing.Pool(2)
+    try:
+        for parallel, given in ((True, pool), (True, None), (False, None)):
+            transactions.sender_cache.clear()
+            decoded = [rlp.decode(rlp.encode(tx), transactions.Transaction)
+                       for tx in txs]
+            transactions.recover_senders(decoded, parallel, given)
+            for i, tx in enumerate(decoded):
+                if i == 3:
+                    assert tx._sender is None
+                else:
+                    assert tx._sender == utils.privtoaddr(keys[i])
+    finally:
+        transactions.MIN_POOL_RECOVERY = min_pool_recovery
+        pool.terminate()
+    # pools started for a batch do not outlive it
+    assert not multiprocessing.active_children()
+
+
+def test_worker_pool():
+    with utils.worker_pool(2) as pool:
+        assert pool.map(abs, [-1, -2]) == [1, 2]
+    assert not multiprocessing.active_children()
+
+
+def test_sender_cache():
+    key = utils.sha3('sender cache')
+    tx = transactions.Transaction(0, 1, 21000, b'\x01' * 20, 0, b'').sign(key)
+    cache = transactions.sender_cache
+    cache.clear()
+    decoded = rlp.decode(rlp.encode(tx), transactions.Transaction)
+    assert decoded.sender == utils.privtoaddr(key)
+    assert len(cache) == 1
+    # decoded again, the sender is not recovered a second time
+    hits = cache.hits
+    decoded = rlp.decode(rlp.encode(tx), transactions.Transaction)
+    assert decoded.sender == utils.privtoaddr(key)
+    assert cache.hits == hits + 1
+    # the signature is part of the key
+    other = transactions.Transaction(0, 1, 21000, b'\x01' * 20, 0, b'',
+                                     tx.v, tx.r, tx.s - 1)
+    assert other.sender != utils.privtoaddr(key)
+    assert len(cache) == 2
@@ -0,0 +1,88 @@
+from ethereum import blocks, utils
+from ethereum.chain import Chain
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB
+from ethereum.snapshot import SnapshotTree
+from ethereum.transactions import Transaction
+
+A, B = b'\x01' * 20, b'\x02' * 20
+K = b'\x00' * 31 + b'\x07'
+
+
+def test_layers():
+    s = SnapshotTree(max_layers=10)
+    s.update(b'r0', b'r1', {A: b'a1'}, {A: {K: 5}}, set())
+    s.update(b'r1', b'r2', {B: b'b2'}, {}, set([A]))
+    assert s.account(b'r2', A) == b'a1'
+    assert s.account(b'r2', B) == b'b2'
+    assert s.storage_value(b'r1', A, K) == 5
+    # wiped storage hides the older layers
+    assert s.storage_value(b'r2', A, K) == 0
+    # misses below the requested root are filled into the disk layer
+    assert s.account(b'r1', B) is None
+    s.fill_account(b'r1', B, b'b0')
+    assert s.account(b'r0', B) == b'b0'
+    assert s.account(b'r2', B) == b'b2'
+    assert s.account(b'unknown', A) is None
+    s.fill_account(b'unknown', A, b'x')
+    assert s.account(b'r0', A) is None
+
+
+def test_cap_drops_stale_forks():
+    s = SnapshotTree(max_layers=2)
+    s.update(b'r0', b'r1', {A: b'a1'}, {}, set())
+    s.update(b'r0', b'fork', {A: b'f'}, {}, set())
+    s.update(b'r1', b'r2', {A: b'a2'}, {}, set())
+    # r1 got merged into the disk layer, the fork from r0 is gone
+    assert len(s) == 1
+    assert s.base.root == b'r1'
+    assert s.account(b'r1', A) == b'a1'
+    assert s.account(b'r2', A) == b'a2'
+    assert b'fork' not in s and b'r0' not in s
+    # a state change from an unknown root starts over
+    s.update(b'other', b'r3', {B: b'b3'}, {}, set())
+    assert s.base.root == b'other' and len(s) == 1
+    assert b'r2' not in s
+
+
+def test_block_reads():
+    env = Env(EphemDB())
+    blk = blocks.genesis(env, start_alloc={utils.encode_hex(A): {'balance': 10}})
+    root = blk.state_root
+    assert root in env.snapshots
+    blk.set_balance(B, 3)
+    blk.set_storage_data(A, 7, 9)
+    blk.commit_state()
+    assert len(env.snapshots) == 2
+    assert env.snapshots.storage_value(blk.state_root, A, K) == 9
+    assert blk.get_balance(A) == 10
+    # the snapshot agrees with the trie
+    snapshots = env.snapshots
+    for blk.snapshots in (snapshots, None):
+        assert blk.get_balance(B) == 3
+        assert blk.get_storage_data(A, 7) == 9
+    blk.snapshots = snapshots
+    blk.del_account(A)
+    assert env.snapshots.account(blk.state_root, A) == b''
+    assert blk._get_acct(A).balance == 0
+    assert blk.get_storage_data(A, 7) == 0
+
+
+def test_head_candidate_layers():
+    key = utils.sha3(b'snapshots')
+    env = Env(EphemDB(), dict(default_config, SNAPSHOT_LAYERS=4))
+    genesis = blocks.genesis(env, start_alloc={
+        utils.encode_hex(utils.privtoaddr(key)): {'balance': 10 ** 18}})
+    chain = Chain(env, genesis=genesis)
+    base, layers = env.snapshots.base.root, set(env.snapshots.layers)
+    assert genesis.state_root in env.snapshots
+    # more pending transactions than layers
+    for i in range(6):
+        tx = Transaction(i, 1, 21000, B, 5, b'').sign(key)
+        assert chain.add_transaction(tx)
+    assert chain.head_candidate.snapshots is not env.snapshots
+    assert chain.head_candidate.get_balance(B) == 30
+    # the layers of the chain are untouched
+    assert env.snapshots.base.root == base
+    assert set(env.snapshots.layers) == layers
+    assert genesis.state_root in env.snapshots
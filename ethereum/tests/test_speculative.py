@@ -0,0 +1,57 @@
+import rlp
+from ethereum import blocks, processblock, speculative, utils
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB
+from ethereum.transactions import Transaction
+
+keys = [utils.sha3(str(i)) for i in range(24)]
+COUNTER = b'\xc0' * 20
+COINBASE_READER = b'\xc1' * 20
+COINBASE = b'\xcb' * 20
+
+
+def mkgenesis(config=None):
+    alloc = dict((utils.encode_hex(utils.privtoaddr(k)), {'balance': 10 ** 18})
+                 for k in keys)
+    # increments storage slot 0
+    alloc[utils.encode_hex(COUNTER)] = {'code': '0x600054600101600055'}
+    # stores the balance of the coinbase in slot 0
+    alloc[utils.encode_hex(COINBASE_READER)] = {'code': '0x4131600055'}
+    return blocks.genesis(Env(EphemDB(), config), start_alloc=alloc)
+
+
+def mktransactions():
+    txs = []
+    # independent transfers
+    for i, k in enumerate(keys[:18]):
+        to = utils.int_to_addr(1000 + i)
+        txs.append(Transaction(0, 1, 21000, to, 5, b'').sign(k))
+    # conflicting calls of the counter, the first one does not conflict
+    for k in keys[18:22]:
+        txs.append(Transaction(0, 1, 100000, COUNTER, 0, b'').sign(k))
+    # a nonce that is only valid after the transaction before
+    txs.append(Transaction(1, 1, 21000, utils.int_to_addr(1), 5, b'').sign(keys[0]))
+    txs.append(Transaction(0, 1, 100000, COINBASE_READER, 0, b'').sign(keys[22]))
+    return txs
+
+
+def test_same_state_as_sequential():
+    txs = mktransactions()
+    genesis = mkgenesis()
+    seq = blocks.Block.init_from_parent(genesis, COINBASE, timestamp=1)
+    for tx in txs:
+        processblock.apply_transaction(seq, tx)
+    par = blocks.Block.init_from_parent(genesis, COINBASE, timestamp=1)
+    assert speculative.apply_transactions(par, txs, processes=2) == 3 + 1 + 1
+    assert par.state_root == seq.state_root
+    assert par.receipts.root_hash == seq.receipts.root_hash
+    assert par.gas_used == seq.gas_used
+    assert par.get_storage_data(COUNTER, 0) == 4
+    # blocks are imported with speculative execution
+    seq.finalize()
+    config = dict(default_config, SPECULATIVE_EXECUTION_PROCESSES=2)
+    genesis2 = mkgenesis(config)
+    assert genesis2.hash == genesis.hash
+    blk = rlp.decode(rlp.encode(seq), blocks.Block, env=genesis2.env,
+                     parent=genesis2)
+    assert blk.state_root == seq.state_root
@@ -16,6 +16,12 @@ def test_state(filename, testname, testdata):
     testutils.check_state_test(testutils.fixture_to_bytes(testdata))
 
 
+def test_state_fastvm(filename, testname, testdata):
+    logger.debug('running test:%r in %r' % (testname, filename))
+    testutils.run_state_test(testutils.fixture_to_bytes(testdata), testutils.VERIFY,
+                             vm_engine='fastvm')
+
+
 def pytest_generate_tests(metafunc):
     testutils.generate_test_params(
         'StateTests',
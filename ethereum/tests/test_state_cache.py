@@ -0,0 +1,37 @@
+from ethereum import blocks, utils
+from ethereum.config import Env
+from ethereum.db import EphemDB
+from ethereum.state_cache import StateCache, ACCOUNT_OVERHEAD
+
+
+def test_accounts_and_code():
+    c = StateCache(max_size=2 * (10 + ACCOUNT_OVERHEAD))
+    c.put_account(b'h' * 10, (1, 0, b'', b''))
+    c.put_code(b'h' * 10, b'x' * 10)
+    # accounts and code do not share keys
+    assert c.get_account(b'h' * 10) == (1, 0, b'', b'')
+    assert c.get_code(b'h' * 10) == b'x' * 10
+    assert c.size == 10 + ACCOUNT_OVERHEAD + 20
+    c.put_account(b'i' * 10, (2, 0, b'', b''))
+    assert c.get_account(b'h' * 10) is None
+    assert c.get_code(b'h' * 10) == b'x' * 10
+
+
+def test_child_blocks_inherit():
+    env = Env(EphemDB())
+    addr = b'\x01' * 20
+    genesis = blocks.genesis(env, start_alloc={
+        utils.encode_hex(addr): {'balance': 10, 'code': '0x6001'}})
+    assert genesis.get_code(addr) == b'\x60\x01'
+    blk = blocks.Block.init_from_parent(genesis, b'\x02' * 20, timestamp=1)
+    cache = env.state_cache
+    hits = cache.hits
+    assert blk.get_balance(addr) == 10
+    assert blk.get_code(addr) == b'\x60\x01'
+    # the account twice and the code, nothing decoded or read from the db
+    assert cache.hits == hits + 3
+    # decoded accounts are copies, changing them does not touch the cache
+    blk.set_balance(addr, 5)
+    blk.commit_state()
+    assert genesis._get_acct(addr).balance == 10
+    assert blk._get_acct(addr).balance == 5
@@ -50,19 +50,20 @@ def run_test(name, pairs):
     for i, permut in enumerate(itertools.permutations(pairs['in'])):
         if i > N_PERMUTATIONS:
             break
-        t = trie.Trie(db.EphemDB())
-        for k, v in permut:
-            #logger.debug('updating with (%s, %s)' %(k, v))
-            if v is not None:
-                t.update(k, v)
-            else:
+        for deferred in (False, True):
+            t = trie.Trie(db.EphemDB(), deferred=deferred)
+            for k, v in permut:
+                #logger.debug('updating with (%s, %s)' %(k, v))
+                if v is not None:
+                    t.update(k, v)
+                else:
+                    t.delete(k)
+            # make sure we have deletes at the end
+            for k, v in deletes:
                 t.delete(k)
-        # make sure we have deletes at the end
-        for k, v in deletes:
-            t.delete(k)
-        if pairs['root'] != b'0x' + encode_hex(t.root_hash):
-            raise Exception("Mismatch: %r %r %r %r" % (
-                name, pairs['root'], b'0x' + encode_hex(t.root_hash), (i, list(permut) + deletes)))
+            if pairs['root'] != b'0x' + encode_hex(t.root_hash):
+                raise Exception("Mismatch: %r %r %r %r" % (
+                    name, pairs['root'], b'0x' + encode_hex(t.root_hash), (i, list(permut) + deletes)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+import itertools
+import random
+import ethereum.trie as trie
+from ethereum import utils
+from ethereum.db import EphemDB
+from ethereum.utils import to_string
+from rlp.utils import decode_hex
+
+# the "dogs" case of the trie fixtures
+dogs = [(b'doe', b'reindeer'), (b'dog', b'puppy'), (b'dogglesworth', b'cat')]
+dogs_root = decode_hex(
+    '8aad789dff2f538bca5d8ea56e8abe10f4c7ba3a5dea95fea4cd6e7c3a1168d3')
+
+
+def test_deferred_commit():
+    for permut in itertools.permutations(dogs + [(b'do', None)]):
+        t = trie.Trie(EphemDB(), deferred=True)
+        for k, v in permut:
+            if v is None:
+                t.delete(k)
+            else:
+                t.update(k, v)
+        assert t.root_hash == dogs_root
+    rand = random.Random(42)
+    t1 = trie.Trie(EphemDB())
+    t2 = trie.Trie(EphemDB(), deferred=True)
+    keys = [utils.sha3(to_string(i))[:rand.randrange(1, 5)] for i in range(200)]
+    for epoch in range(20):
+        for i in range(rand.randrange(1, 60)):
+            k = rand.choice(keys)
+            if rand.random() < 0.3:
+                t1.delete(k)
+                t2.delete(k)
+            else:
+                v = to_string(rand.randrange(10 ** 6)) * rand.randrange(1, 4)
+                t1.update(k, v)
+                t2.update(k, v)
+        if epoch % 5 == 4:
+            # nothing is stored before the commit
+            assert t2.dirty
+            stored = len(t2.db.kv)
+            t2.update(b'\xff' * 32, b'x' * 40)
+            t2.delete(b'\xff' * 32)
+            assert len(t2.db.kv) == stored
+        t2.commit()
+        assert t2.root_hash == t1.root_hash
+        assert t2.to_dict() == t1.to_dict()
+    # only nodes reachable at some commit are stored
+    assert set(t2.db.kv) <= set(t1.db.kv)
+
+
+def test_bulk_load():
+    assert trie.Trie(EphemDB()).bulk_load(sorted(dogs)) == dogs_root
+    items = dict((utils.sha3(to_string(i))[:i % 5 + 1], to_string(i) * (i % 7 + 1))
+                 for i in range(500))
+    t1 = trie.Trie(EphemDB())
+    for k, v in items.items():
+        t1.update(k, v)
+    t2 = trie.Trie(EphemDB())
+    assert t2.bulk_load(sorted(items.items())) == t1.root_hash
+    assert t2.to_dict() == items
+    assert set(t2.db.kv) <= set(t1.db.kv)
+    t2.update(b'new', b'value')
+    t1.update(b'new', b'value')
+    assert t2.root_hash == t1.root_hash
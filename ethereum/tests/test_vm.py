@@ -14,6 +14,16 @@ def test_vm(filename, testname, testdata):
     testutils.check_vm_test(testutils.fixture_to_bytes(testdata))
 
 
+def test_vm_table(filename, testname, testdata):
+    testutils.run_vm_test(testutils.fixture_to_bytes(testdata), testutils.VERIFY,
+                          interpreter='table')
+
+
+def test_vm_fastvm(filename, testname, testdata):
+    testutils.run_vm_test(testutils.fixture_to_bytes(testdata), testutils.VERIFY,
+                          vm_engine='fastvm')
+
+
 def pytest_generate_tests(metafunc):
     testutils.generate_test_params('VMTests', metafunc)
 
@@ -0,0 +1,123 @@
+import random
+from rlp.utils import ascii_chr
+from ethereum import blocks, fastvm, opcodes, processblock, utils, vm
+from ethereum.config import Env, default_config
+from ethereum.db import EphemDB
+from ethereum.transactions import Transaction
+
+key = utils.sha3('interpreters')
+CALLEE = b'\xca' * 20
+
+# hand written programs covering memory, storage, logs, calls and jumps
+programs = [
+    # store 1 + 2 in slot 0 and return it
+    '0x6002600101806000556000526020 6000f3',
+    # sha3 of calldata, logged with two topics
+    '0x366000600037602060002060016002 60206000a2',
+    # loop counting slot 1 up to 10
+    '0x5b600154600101806001556009 11 600057',
+    # call the callee with value and copy its output
+    '0x60206000600060006001 73' + 'ca' * 20 + ' 61c350f1 600051600255',
+    # exponent, signed arithmetic, byte and signextend
+    '0x600360ff0a6000036005056003600007 601e1a 600b 0b 01 600355',
+    # jump into pushdata
+    '0x6003566000',
+    # codecopy, extcodesize and suicide
+    '0x600a60006000396000516004 55 73' + 'ca' * 20 + ' 3b600555 33ff',
+]
+
+
+def random_code(rnd, length):
+    ops = sorted(opcodes.opcodes)
+    code = b''
+    while len(code) < length:
+        opcode = rnd.choice(ops)
+        if opcode in (0xf0, 0xf1, 0xf2, 0xf4, 0xff, 0x56, 0x57):
+            # keep calls, creates and jumps rare
+            opcode = rnd.choice(ops)
+        code += ascii_chr(opcode)
+        if 0x60 <= opcode <= 0x7f:
+            # mostly small arguments
+            code += b'\x00' * (opcode - 0x60) + ascii_chr(rnd.randrange(64))
+    return code
+
+
+def run(code, interpreter, data=b'\x01\x02\x03', code_db=None):
+    addr = b'\xc0' * 20
+    config = dict(default_config)
+    if interpreter == 'fastvm':
+        config['VM_ENGINE'], interpreter = 'fastvm', vm.INTERPRETER
+    genesis = blocks.genesis(Env(EphemDB(), config, code_db=code_db), start_alloc={
+        utils.encode_hex(utils.privtoaddr(key)): {'balance': 10 ** 18},
+        utils.encode_hex(addr): {'balance': 100, 'code': utils.encode_hex(code)},
+        utils.encode_hex(CALLEE): {'code': '0x3360005260206000f3'}})
+    blk = blocks.Block.init_from_parent(genesis, b'\xcb' * 20, timestamp=1)
+    tx = Transaction(0, 1, 300000, addr, 7, data).sign(key)
+    default, vm.INTERPRETER = vm.INTERPRETER, interpreter
+    try:
+        success, output = processblock.apply_transaction(blk, tx)
+    finally:
+        vm.INTERPRETER = default
+    return success, output, blk.state_root, blk.gas_used, \
+        blk.receipts.root_hash
+
+
+def test_programs():
+    for program in programs:
+        code = utils.decode_hex(program[2:].replace(' ', ''))
+        expected = run(code, 'switch')
+        assert run(code, 'table') == expected
+        assert run(code, 'fastvm') == expected
+
+
+def test_random_code():
+    rnd = random.Random(7)
+    for i in range(200):
+        code = random_code(rnd, rnd.randrange(1, 64))
+        expected = run(code, 'switch')
+        assert run(code, 'table') == expected, utils.encode_hex(code)
+        assert run(code, 'fastvm') == expected, utils.encode_hex(code)
+
+
+def test_vm_execute():
+    code = utils.decode_hex(programs[1][2:].replace(' ', ''))
+    genesis = blocks.genesis(Env(EphemDB()))
+    tx = Transaction(0, 1, 100000, b'', 0, b'').sign(key)
+    results = []
+    for interpreter in ('switch', 'table', 'fastvm'):
+        blk = blocks.Block.init_from_parent(genesis, b'\xcb' * 20, timestamp=1)
+        ext = processblock.VMExt(blk, tx)
+        msg = vm.Message(tx.sender, b'\xc0' * 20, 0, 10000,
+                         vm.CallData(b'\x01\x02\x03'))
+        if interpreter == 'fastvm':
+            result = fastvm.vm_execute(ext, msg, code)
+        else:
+            result = vm.vm_execute(ext, msg, code, interpreter)
+        results.append((result, [(l.topics, l.data) for l in blk.logs]))
+    assert results[0] == results[1] == results[2]
+    assert results[0][0][0] == 1 and len(results[0][1]) == 1
+
+
+def test_memory():
+    value = bytes(bytearray(range(1, 33)))
+    # unaligned mstore, mload of it and a codecopy reaching past the code
+    code = b'\x7f' + value + b'\x60\x01\x52\x60\x01\x51\x60\x60\x52' + \
+        b'\x60\x08\x60\x32\x60\x40\x39\x60\x80\x60\x00\xf3'
+    expected = b'\x00' + value + b'\x00' * 31 + code[50:] + b'\x00' * 4 + \
+        b'\x00' * 24 + value
+    for interpreter in ('switch', 'table', 'fastvm'):
+        success, output = run(code, interpreter)[:2]
+        assert success and output == expected
+
+
+def test_call_data():
+    cd = vm.CallData(bytearray(b'xxabcdefyy'), 2, 6)
+    assert cd.extract_all() == b'abcdef'
+    assert cd.extract(4, 5) == b'ef\x00\x00\x00'
+    assert cd.extract(9, 2) == b'\x00\x00'
+    assert cd.extract32(0) == utils.big_endian_to_int(b'abcdef' + b'\x00' * 26)
+    assert cd.extract32(6) == cd.extract32(2 ** 256 - 1) == 0
+    mem = bytearray(10)
+    cd.extract_copy(mem, 1, 3, 8)
+    assert mem == bytearray(b'\x00def' + b'\x00' * 6)
+    assert vm.CallData(b'abc').extract_all() == b'abc'
@@ -1,7 +1,7 @@
 import pytest
 
 from ethereum import tester as t
-from ethereum import blocks, utils, transactions, vm, abi, opcodes
+from ethereum import blocks, utils, transactions, vm, fastvm, abi, opcodes
 from ethereum.exceptions import InvalidTransaction
 import rlp
 from rlp.utils import decode_hex, encode_hex, ascii_chr, str_to_bytes
@@ -123,7 +123,7 @@ def mktest(code, language, data=None, fun=None, args=None,
 
 
 # Fills up a vm test without post data, or runs the test
-def run_vm_test(params, mode, profiler=None):
+def run_vm_test(params, mode, profiler=None, interpreter=None, vm_engine='vm'):
     pre = params['pre']
     exek = params['exec']
     env = params['env']
@@ -213,12 +213,15 @@ def run_vm_test(params, mode, profiler=None):
     ext.block_hash = blkhash
 
     msg = vm.Message(tx.sender, tx.to, tx.value, tx.startgas,
-                     vm.CallData([safe_ord(x) for x in tx.data]))
+                     vm.CallData(tx.data))
     code = decode_hex(exek['code'][2:])
     time_pre = time.time()
     if profiler:
         profiler.enable()
-    success, gas_remained, output = vm.vm_execute(ext, msg, code)
+    if vm_engine == 'fastvm':
+        success, gas_remained, output = fastvm.vm_execute(ext, msg, code)
+    else:
+        success, gas_remained, output = vm.vm_execute(ext, msg, code, interpreter)
     if profiler:
         profiler.disable()
     pb.apply_msg = orig_apply_msg
@@ -275,7 +278,7 @@ def run_vm_test(params, mode, profiler=None):
 
 
 # Fills up a vm test without post data, or runs the test
-def run_state_test(params, mode):
+def run_state_test(params, mode, vm_engine='vm'):
     pre = params['pre']
     exek = params['transaction']
     env = params['env']
@@ -293,7 +296,11 @@ def run_state_test(params, mode):
         difficulty=parse_int_or_hex(env['currentDifficulty']),
         gas_limit=parse_int_or_hex(env['currentGasLimit']),
         timestamp=parse_int_or_hex(env['currentTimestamp']))
-    blk = blocks.Block(header, env=db_env)
+    if vm_engine == db_env.config['VM_ENGINE']:
+        blk = blocks.Block(header, env=db_env)
+    else:
+        blk = blocks.Block(header, env=Env(db, dict(db_env.config,
+                                                    VM_ENGINE=vm_engine)))
 
     # setup state
     for address, h in list(pre.items()):
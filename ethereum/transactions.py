@@ -9,6 +9,7 @@ from ethereum.exceptions import InvalidTransaction
 from ethereum import bloom
 from ethereum import opcodes
 from ethereum import utils
+from ethereum.lru import LRUCache
 from ethereum.slogging import get_logger
 from ethereum.utils import TT256, mk_contract_address, zpad, int_to_32bytearray, big_endian_to_int
 
@@ -18,6 +19,108 @@ log = get_logger('eth.chain.tx')
 # in the yellow paper it is specified that s should be smaller than secpk1n (eq.205)
 secpk1n = 115792089237316195423570985008687907852837564279074904382605163141518161494337
 
+# Batches smaller than this are recovered in process, as handing them to a
+# pool costs more than it saves
+MIN_PARALLEL_RECOVERY = 16
+# Batches recovered without a pool only get one of their own from this size
+# on, as starting the workers takes as long as hundreds of recoveries
+MIN_POOL_RECOVERY = 512
+# Number of sender recovery processes started per batch, None for one per cpu
+RECOVERY_PROCESSES = None
+# Creating a secp256k1 context is far more expensive than a recovery, so
+# every process creates one and reuses it. The key owning the context is
+# kept, as the context is destroyed together with it.
+_secp256k1_key = None
+# Number of recovered senders remembered by `sender_cache`
+SENDER_CACHE_SIZE = 16384
+
+
+# Recovered senders, keyed by the signing hash together with the signature
+# as the same unsigned transaction can be signed by different keys. The
+# same transaction is decoded again when it is added to the chain, when the
+# head candidate is rebuilt and when its block is imported, this way it is
+# still recovered only once.
+sender_cache = LRUCache(SENDER_CACHE_SIZE)
+
+
+def ecrecover_to_address(rawhash, v, r, s):
+    """Recover the address of the key that signed `rawhash`.
+
+    :raises: :exc:`InvalidTransaction` if the signature is invalid
+    """
+    if r >= N or s >= N or v < 27 or v > 28 or r == 0 or s == 0:
+        raise InvalidTransaction("Invalid signature values!")
+    global _secp256k1_key
+    if _secp256k1_key is None:
+        _secp256k1_key = PublicKey(flags=ALL_FLAGS)
+    pk = PublicKey(flags=ALL_FLAGS, ctx=_secp256k1_key.ctx)
+    try:
+        pk.public_key = pk.ecdsa_recover(
+            rawhash,
+            pk.ecdsa_recoverable_deserialize(
+                zpad("".join(chr(c) for c in int_to_32bytearray(r)), 32) + zpad("".join(chr(c) for c in int_to_32bytearray(s)), 32),
+                v - 27
+            ),
+            raw=True
+        )
+        pub = pk.serialize(compressed=False)
+    except Exception:
+        raise InvalidTransaction("Invalid signature values (x^3+7 is non-residue)")
+
+    if pub[1:] == "\x00" * 32:
+        raise InvalidTransaction("Invalid signature (zero privkey cannot sign)")
+    pub = encode_pubkey(pub, 'bin')
+    return utils.sha3(pub[1:])[-20:]
+
+
+def _recover_or_none(args):
+    try:
+        return ecrecover_to_address(*args)
+    except InvalidTransaction:
+        return None
+
+
+def recover_senders(transactions, parallel=True, pool=None):
+    """Recover the senders of a batch of transactions ahead of execution.
+
+    Signatures are checked on `pool`, or for large batches on a pool of
+    :data:`RECOVERY_PROCESSES` workers started and terminated for the
+    batch, and the senders are cached on the transactions. Transactions
+    with invalid signatures are skipped, accessing their `sender` raises as
+    usual.
+
+    :param parallel: `False` to recover in this process
+    :param pool: a multiprocessing pool owned by the caller
+    """
+    todo, args = [], []
+    for tx in transactions:
+        if tx._sender or not tx.v:
+            continue
+        key = tx._signature_key()
+        sender = sender_cache.get(key)
+        if sender is not None:
+            tx._sender = sender
+        else:
+            todo.append(tx)
+            args.append(key)
+    if not todo:
+        return
+    senders = None
+    if parallel and pool is not None and len(todo) >= MIN_PARALLEL_RECOVERY:
+        senders = pool.map(_recover_or_none, args)
+    elif parallel and len(todo) >= MIN_POOL_RECOVERY:
+        with utils.worker_pool(RECOVERY_PROCESSES) as pool:
+            if pool is not None:
+                senders = pool.map(_recover_or_none, args)
+            else:
+                log.debug('recovering senders in process')
+    if senders is None:
+        senders = [_recover_or_none(a) for a in args]
+    for tx, key, sender in zip(todo, args, senders):
+        if sender is not None:
+            tx._sender = sender
+            sender_cache.put(key, sender)
+
 
 class Transaction(rlp.Serializable):
 
@@ -73,32 +176,13 @@ class Transaction(rlp.Serializable):
         if not self._sender:
             # Determine sender
             if self.v:
-                if self.r >= N or self.s >= N or self.v < 27 or self.v > 28 \
-                or self.r == 0 or self.s == 0:
-                    raise InvalidTransaction("Invalid signature values!")
-                log.debug('recovering sender')
-                rlpdata = rlp.encode(self, UnsignedTransaction)
-                rawhash = utils.sha3(rlpdata)
-
-                pk = PublicKey(flags=ALL_FLAGS)
-                try:
-                    pk.public_key = pk.ecdsa_recover(
-                        rawhash,
-                        pk.ecdsa_recoverable_deserialize(
-                            zpad("".join(chr(c) for c in int_to_32bytearray(self.r)), 32) + zpad("".join(chr(c) for c in int_to_32bytearray(self.s)), 32),
-                            self.v - 27
-                        ),
-                        raw=True
-                    )
-                    pub = pk.serialize(compressed=False)
-                except Exception:
-                    raise InvalidTransaction("Invalid signature values (x^3+7 is non-residue)")
-
-                if pub[1:] == "\x00" * 32:
-                    raise InvalidTransaction("Invalid signature (zero privkey cannot sign)")
-                pub = encode_pubkey(pub, 'bin')
-                self._sender = utils.sha3(pub[1:])[-20:]
-                assert self.sender == self._sender
+                key = self._signature_key()
+                sender = sender_cache.get(key)
+                if sender is None:
+                    log.debug('recovering sender')
+                    sender = ecrecover_to_address(*key)
+                    sender_cache.put(key, sender)
+                self._sender = sender
             else:
                 self._sender = 0
         return self._sender
@@ -107,6 +191,10 @@ class Transaction(rlp.Serializable):
     def sender(self, value):
         self._sender = value
 
+    def _signature_key(self):
+        rawhash = utils.sha3(rlp.encode(self, UnsignedTransaction))
+        return rawhash, self.v, self.r, self.s
+
     def sign(self, key):
         """Sign this transaction with a private key.
 
@@ -130,6 +218,7 @@ class Transaction(rlp.Serializable):
         self.s = big_endian_to_int(signature[32:64])
 
         self.sender = utils.privtoaddr(key)
+        sender_cache.put((rawhash, self.v, self.r, self.s), self.sender)
         return self
 
     @property
@@ -5,6 +5,7 @@ from ethereum import utils
 from ethereum.utils import to_string
 from ethereum.abi import is_string
 import copy
+from itertools import groupby
 from rlp.utils import decode_hex, encode_hex, ascii_chr, str_to_bytes
 from ethereum.fast_rlp import encode_optimized
 rlp_encode = encode_optimized
@@ -15,6 +16,9 @@ hti = {}
 for i, c in enumerate(b'0123456789abcdef'):
     hti[c] = i
 
+# index of a hex digit in a hex path, see `unpack_to_hex_path`
+hex_index = dict((c, i) for i, c in enumerate('0123456789abcdef'))
+
 
 def bin_to_nibbles(s):
     """convert string s to nibbles (half-bytes)
@@ -28,7 +32,7 @@ def bin_to_nibbles(s):
     >>> bin_to_nibbles("hello")
     [6, 8, 6, 5, 6, 12, 6, 12, 6, 15]
     """
-    return [hti[c] for c in encode_hex(s)]
+    return list(map(hti.__getitem__, encode_hex(s)))
 
 
 def nibbles_to_bin(nibbles):
@@ -38,10 +42,8 @@ def nibbles_to_bin(nibbles):
     if len(nibbles) % 2:
         raise Exception("nibbles must be of even numbers")
 
-    res = b''
-    for i in range(0, len(nibbles), 2):
-        res += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return res
+    return b''.join([ascii_chr(16 * nibbles[i] + nibbles[i + 1])
+                     for i in range(0, len(nibbles), 2)])
 
 
 NIBBLE_TERMINATOR = 16
@@ -140,10 +142,8 @@ def pack_nibbles(nibbles):
         nibbles = [flags] + nibbles
     else:
         nibbles = [flags, 0] + nibbles
-    o = b''
-    for i in range(0, len(nibbles), 2):
-        o += ascii_chr(16 * nibbles[i] + nibbles[i + 1])
-    return o
+    return b''.join([ascii_chr(16 * nibbles[i] + nibbles[i + 1])
+                     for i in range(0, len(nibbles), 2)])
 
 
 def unpack_to_nibbles(bindata):
@@ -163,6 +163,31 @@ def unpack_to_nibbles(bindata):
     return o
 
 
+def unpack_to_hex_path(bindata):
+    """unpack packed binary data to a hex path
+
+    Hex paths are a compact form of nibble sequences without terminator:
+    the hex encoding of a key, so that prefixes can be compared with
+    string operations.
+
+    :param bindata: binary packed from nibbles
+    :return: hex path
+    """
+    o = encode_hex(bindata)
+    if o[0] in '13':
+        return o[1:]
+    return o[2:]
+
+
+def is_beyond(prefix, end):
+    ''' test whether all keys starting with prefix are not smaller
+    than end
+    '''
+    if len(prefix) >= len(end):
+        return prefix[:len(end)] >= end
+    return prefix > end[:len(prefix)]
+
+
 def starts_with(full, part):
     ''' test whether the items in the part is
     the leading items of the full
@@ -194,14 +219,19 @@ def transient_trie_exception(*args):
 
 class Trie(object):
 
-    def __init__(self, db, root_hash=BLANK_ROOT, transient=False):
+    def __init__(self, db, root_hash=BLANK_ROOT, transient=False,
+                 deferred=False):
         '''it also present a dictionary like interface
 
         :param db key value database
         :root: blank or trie node in form of [key, value] or [v0,v1..v15,v]
+        :param deferred: keep changed nodes in memory and only hash and
+            store them on `commit`
         '''
         self.db = db  # Pass in a database object directly
         self.transient = transient
+        self.deferred = deferred
+        self.dirty = False
         if self.transient:
             self.update = self.get = self.delete = transient_trie_exception
         self.set_root_hash(root_hash)
@@ -250,6 +280,8 @@ class Trie(object):
     def get_root_hash(self):
         if self.transient:
             return self.transient_root_hash
+        if self.deferred:
+            self.commit()
         if self.root_node == BLANK_NODE:
             return BLANK_ROOT
         assert isinstance(self.root_node, list)
@@ -269,6 +301,7 @@ class Trie(object):
         if self.transient:
             self.transient_root_hash = root_hash
             return
+        self.dirty = False
         if root_hash == BLANK_ROOT:
             self.root_node = BLANK_NODE
             return
@@ -293,12 +326,19 @@ class Trie(object):
         if node == BLANK_NODE:
             return BLANK_NODE
         assert isinstance(node, list)
+        if self.deferred:
+            # stays in memory until commit
+            return node
+        return self._store_node(node)
+
+    def _store_node(self, node):
         rlpnode = rlp_encode(node)
         if len(rlpnode) < 32:
             return node
 
         hashkey = utils.sha3(rlpnode)
         self.db.put(hashkey, rlpnode)
+        self.db.node_cache.put(hashkey, rlpnode, node)
         self.spv_storing(node)
         return hashkey
 
@@ -307,7 +347,12 @@ class Trie(object):
             return BLANK_NODE
         if isinstance(encoded, list):
             return encoded
-        o = rlp.decode(self.db.get(encoded))
+        node_cache = self.db.node_cache
+        o = node_cache.get(encoded)
+        if o is None:
+            rlpnode = self.db.get(encoded)
+            o = rlp.decode(rlpnode)
+            node_cache.put(encoded, rlpnode, o)
         self.spv_grabbing(o)
         return o
 
@@ -321,9 +366,8 @@ class Trie(object):
             return NODE_TYPE_BLANK
 
         if len(node) == 2:
-            nibbles = unpack_to_nibbles(node[0])
-            has_terminator = (nibbles and nibbles[-1] == NIBBLE_TERMINATOR)
-            return NODE_TYPE_LEAF if has_terminator\
+            # the terminator flag is in the high nibble of the first byte
+            return NODE_TYPE_LEAF if node[0][:1] >= b'\x20' \
                 else NODE_TYPE_EXTENSION
         if len(node) == 17:
             return NODE_TYPE_BRANCH
@@ -332,34 +376,34 @@ class Trie(object):
         """ get value inside a node
 
         :param node: node in form of list, or BLANK_NODE
-        :param key: nibble list without terminator
+        :param key: hex path of the key
         :return:
             BLANK_NODE if does not exist, otherwise value or hash
         """
-        node_type = self._get_node_type(node)
+        while True:
+            node_type = self._get_node_type(node)
 
-        if node_type == NODE_TYPE_BLANK:
-            return BLANK_NODE
+            if node_type == NODE_TYPE_BLANK:
+                return BLANK_NODE
 
-        if node_type == NODE_TYPE_BRANCH:
-            # already reach the expected node
-            if not key:
-                return node[-1]
-            sub_node = self._decode_to_node(node[key[0]])
-            return self._get(sub_node, key[1:])
+            if node_type == NODE_TYPE_BRANCH:
+                # already reach the expected node
+                if not key:
+                    return node[-1]
+                node = self._decode_to_node(node[hex_index[key[0]]])
+                key = key[1:]
+                continue
 
-        # key value node
-        curr_key = without_terminator(unpack_to_nibbles(node[0]))
-        if node_type == NODE_TYPE_LEAF:
-            return node[1] if key == curr_key else BLANK_NODE
+            # key value node
+            curr_key = unpack_to_hex_path(node[0])
+            if node_type == NODE_TYPE_LEAF:
+                return node[1] if key == curr_key else BLANK_NODE
 
-        if node_type == NODE_TYPE_EXTENSION:
             # traverse child nodes
-            if starts_with(key, curr_key):
-                sub_node = self._decode_to_node(node[1])
-                return self._get(sub_node, key[len(curr_key):])
-            else:
+            if not key.startswith(curr_key):
                 return BLANK_NODE
+            node = self._decode_to_node(node[1])
+            key = key[len(curr_key):]
 
     def _update(self, node, key, value):
         """ update item inside a node
@@ -826,7 +870,10 @@ class Trie(object):
         self.root_node = self._delete_and_delete_storage(
             self.root_node,
             bin_to_nibbles(to_string(key)))
-        self.get_root_hash()
+        if self.deferred:
+            self.dirty = True
+        else:
+            self.get_root_hash()
 
     def _get_size(self, node):
         '''Get counts of (key, value) stored in this and the descendant nodes
@@ -850,106 +897,86 @@ class Trie(object):
             sizes = sizes + [1 if node[-1] else 0]
             return sum(sizes)
 
-    def _iter_branch(self, node):
-        '''yield (key, value) stored in this and the descendant nodes
-        :param node: node in form of list, or BLANK_NODE
-
-        .. note::
-            Here key is in full form, rather than key of the individual node
-        '''
-        if node == BLANK_NODE:
-            raise StopIteration
-
-        node_type = self._get_node_type(node)
-
-        if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
-            if node_type == NODE_TYPE_EXTENSION:
-                sub_tree = self._iter_branch(self._decode_to_node(node[1]))
-            else:
-                sub_tree = [(to_string(NIBBLE_TERMINATOR), node[1])]
-
-            # prepend key of this node to the keys of children
-            for sub_key, sub_value in sub_tree:
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                yield (full_key, sub_value)
-
-        elif node_type == NODE_TYPE_BRANCH:
-            for i in range(16):
-                sub_tree = self._iter_branch(self._decode_to_node(node[i]))
-                for sub_key, sub_value in sub_tree:
-                    full_key = (str_to_bytes(str(i)) + b'+' + sub_key).strip(b'+')
-                    yield (full_key, sub_value)
-            if node[16]:
-                yield (to_string(NIBBLE_TERMINATOR), node[-1])
-
-    def iter_branch(self):
-        for key_str, value in self._iter_branch(self.root_node):
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
-            key = nibbles_to_bin(without_terminator(nibbles))
-            yield key, value
-
-    def _to_dict(self, node):
-        '''convert (key, value) stored in this and the descendant nodes
-        to dict items.
+    def iter_branch(self, start=None, end=None):
+        '''yield the (key, value) pairs stored in the trie in key order
 
-        :param node: node in form of list, or BLANK_NODE
-
-        .. note::
+        The trie is walked with an explicit stack, so neither memory use
+        nor recursion depth grow with the size of the trie.
 
-            Here key is in full form, rather than key of the individual node
+        :param start: if given, skip keys smaller than start
+        :param end: if given, stop before the first key not smaller than end
         '''
-        if node == BLANK_NODE:
-            return {}
-
-        node_type = self._get_node_type(node)
+        start = bin_to_nibbles(to_string(start)) if start is not None else []
+        if end is not None:
+            end = bin_to_nibbles(to_string(end))
+        stack = [(self.root_node, [])]
+        while stack:
+            node, path = stack.pop()
+            if path < start[:len(path)]:
+                continue
+            if end is not None and is_beyond(path, end):
+                return
+            node = self._decode_to_node(node)
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_LEAF:
+                key = path + without_terminator(unpack_to_nibbles(node[0]))
+                if key >= start and (end is None or key < end):
+                    yield nibbles_to_bin(key), node[1]
+            elif node_type == NODE_TYPE_EXTENSION:
+                key = path + without_terminator(unpack_to_nibbles(node[0]))
+                stack.append((node[1], key))
+            elif node_type == NODE_TYPE_BRANCH:
+                for i in range(15, -1, -1):
+                    if node[i]:
+                        stack.append((node[i], path + [i]))
+                if node[16] and path >= start:
+                    yield nibbles_to_bin(path), node[16]
 
-        if is_key_value_type(node_type):
-            nibbles = without_terminator(unpack_to_nibbles(node[0]))
-            key = b'+'.join([to_string(x) for x in nibbles])
-            if node_type == NODE_TYPE_EXTENSION:
-                sub_dict = self._to_dict(self._decode_to_node(node[1]))
-            else:
-                sub_dict = {to_string(NIBBLE_TERMINATOR): node[1]}
-
-            # prepend key of this node to the keys of children
-            res = {}
-            for sub_key, sub_value in sub_dict.items():
-                full_key = (key + b'+' + sub_key).strip(b'+')
-                res[full_key] = sub_value
-            return res
-
-        elif node_type == NODE_TYPE_BRANCH:
-            res = {}
-            for i in range(16):
-                sub_dict = self._to_dict(self._decode_to_node(node[i]))
+    def to_dict(self):
+        return dict(self.iter_branch())
 
-                for sub_key, sub_value in sub_dict.items():
-                    full_key = (str_to_bytes(str(i)) + b'+' + sub_key).strip(b'+')
-                    res[full_key] = sub_value
+    def get(self, key):
+        return self._get(self.root_node, encode_hex(to_string(key)))
 
-            if node[16]:
-                res[to_string(NIBBLE_TERMINATOR)] = node[-1]
-            return res
+    def get_many(self, keys):
+        '''get the values of several keys in a single walk of the trie
 
-    def to_dict(self):
-        d = self._to_dict(self.root_node)
-        res = {}
-        for key_str, value in d.items():
-            if key_str:
-                nibbles = [int(x) for x in key_str.split(b'+')]
-            else:
-                nibbles = []
-            key = nibbles_to_bin(without_terminator(nibbles))
-            res[key] = value
-        return res
+        The keys are sorted by hex path, so every node is decoded only
+        once no matter how many of the keys go through it.
 
-    def get(self, key):
-        return self._get(self.root_node, bin_to_nibbles(to_string(key)))
+        :param keys: list of keys
+        :return: list of values in the order of keys, BLANK_NODE for keys
+            which do not exist
+        '''
+        values = [BLANK_NODE] * len(keys)
+        paths = sorted((encode_hex(to_string(key)), i)
+                       for i, key in enumerate(keys))
+        stack = [(self.root_node, paths)]
+        while stack:
+            node, paths = stack.pop()
+            node = self._decode_to_node(node)
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_BRANCH:
+                for path, i in paths:
+                    if path:
+                        break
+                    values[i] = node[-1]
+                for nibble, group in groupby(paths, lambda p: p[0][:1]):
+                    if nibble and node[hex_index[nibble]]:
+                        stack.append((node[hex_index[nibble]],
+                                      [(path[1:], i) for path, i in group]))
+            elif is_key_value_type(node_type):
+                curr_key = unpack_to_hex_path(node[0])
+                if node_type == NODE_TYPE_LEAF:
+                    for path, i in paths:
+                        if path == curr_key:
+                            values[i] = node[1]
+                else:
+                    group = [(path[len(curr_key):], i) for path, i in paths
+                             if path.startswith(curr_key)]
+                    if group:
+                        stack.append((node[1], group))
+        return values
 
     def __len__(self):
         return self._get_size(self.root_node)
@@ -964,7 +991,7 @@ class Trie(object):
         return self.delete(key)
 
     def __iter__(self):
-        return iter(self.to_dict())
+        return (key for key, value in self.iter_branch())
 
     def __contains__(self, key):
         return self.get(key) != BLANK_NODE
@@ -989,7 +1016,96 @@ class Trie(object):
             self.root_node,
             bin_to_nibbles(to_string(key)),
             to_string(value))
-        self.get_root_hash()
+        if self.deferred:
+            self.dirty = True
+        else:
+            self.get_root_hash()
+
+    def commit(self):
+        '''hash and store the nodes changed since the last commit
+        '''
+        if not self.dirty:
+            return
+        self.dirty = False
+        self._commit_node(self.root_node)
+
+    def _commit_node(self, node):
+        '''store the in memory children of a node, bottom up
+        '''
+        node_type = self._get_node_type(node)
+        if node_type == NODE_TYPE_BRANCH:
+            indices = range(16)
+        elif node_type == NODE_TYPE_EXTENSION:
+            indices = [1]
+        else:
+            return
+        for i in indices:
+            if isinstance(node[i], list):
+                self._commit_node(node[i])
+                node[i] = self._store_node(node[i])
+
+    def bulk_load(self, items):
+        '''build the trie from (key, value) pairs in a single pass
+
+        Nodes are stored as soon as no later key can change them, so every
+        node is hashed once and only the path of the last key is kept in
+        memory.
+
+        :param items: iterable of (key, value) pairs, sorted by key
+        :return: the root hash
+        '''
+        if self.root_node != BLANK_NODE:
+            raise Exception("Bulk loading requires an empty trie")
+        deferred, self.deferred = self.deferred, True
+        try:
+            last_key = None
+            for key, value in items:
+                if not is_string(key):
+                    raise Exception("Key must be string")
+                if not is_string(value):
+                    raise Exception("Value must be string")
+                key = bin_to_nibbles(to_string(key))
+                if last_key is not None and key <= last_key:
+                    raise Exception("Keys must be unique and sorted")
+                self.root_node = self._update(self.root_node, key,
+                                              to_string(value))
+                if last_key is not None:
+                    self._store_left(self.root_node, key, last_key)
+                last_key = key
+            self.dirty = True
+            self.commit()
+        finally:
+            self.deferred = deferred
+        return self.get_root_hash()
+
+    def _store_left(self, node, key, last_key):
+        '''store the subtree of the previous key which just got a sibling
+        to its right, with sorted inserts it can not change anymore
+        '''
+        prefix_length = 0
+        for a, b in zip(key, last_key):
+            if a != b:
+                break
+            prefix_length += 1
+        if prefix_length == len(last_key):
+            return
+        depth = 0
+        while isinstance(node, list):
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_BRANCH:
+                if depth == prefix_length:
+                    i = last_key[depth]
+                    if isinstance(node[i], list):
+                        self._commit_node(node[i])
+                        node[i] = self._store_node(node[i])
+                    return
+                node = node[key[depth]]
+                depth += 1
+            elif node_type == NODE_TYPE_EXTENSION:
+                depth += len(without_terminator(unpack_to_nibbles(node[0])))
+                node = node[1]
+            else:
+                return
 
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
@@ -5,6 +5,8 @@ except:
     import sha3 as _sha3
     sha3_256 = lambda x: _sha3.sha3_256(x).digest()
 from bitcoin import privtopub
+import contextlib
+import multiprocessing
 import sys
 import rlp
 from rlp.sedes import big_endian_int, BigEndianInt, Binary
@@ -387,6 +389,25 @@ def print_func_call(ignore_first_arg=False, max_call_number=100):
     return inner
 
 
+@contextlib.contextmanager
+def worker_pool(processes=None, initializer=None):
+    """Run a multiprocessing pool of `processes` workers (`None` for one
+    per cpu) for the duration of a with block, terminating it on exit.
+
+    Gives `None` if no worker processes can be started, e.g. because none
+    are available or this is a daemonic process itself.
+    """
+    try:
+        pool = multiprocessing.Pool(processes, initializer)
+    except (OSError, AssertionError):
+        pool = None
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
 def dump_state(trie):
     res = ''
     for k, v in list(trie.to_dict().items()):
@@ -4,6 +4,7 @@ verify_stack_after_op = False
 
 #  ######################################
 import sys
+import binascii
 
 from ethereum import utils
 from ethereum.abi import is_numeric
@@ -11,6 +12,7 @@ import copy
 from ethereum import opcodes
 import time
 from ethereum.slogging import get_logger
+from ethereum.code_cache import CodeCache
 from rlp.utils import encode_hex, ascii_chr
 from ethereum.utils import to_string
 
@@ -28,29 +30,49 @@ TT255 = 2 ** 255
 
 class CallData(object):
 
+    """
+    Data of a message, a window into the memory of the calling frame or
+    into the data of a transaction, which is referenced without copying.
+
+    Parts of it are read with single slices of the underlying buffer. No
+    memoryview is kept, as it would prevent the memory of the calling frame
+    from growing.
+    """
+
     def __init__(self, parent_memory, offset=0, size=None):
+        if isinstance(parent_memory, list):
+            parent_memory = bytearray(parent_memory)
         self.data = parent_memory
         self.offset = offset
         self.size = len(self.data) if size is None else size
         self.rlimit = self.offset + self.size
 
+    def _slice(self, start, size):
+        # the data from start on, at most size bytes
+        if start >= self.size:
+            return b''
+        end = min(start + size, self.size)
+        return self.data[self.offset + start: self.offset + end]
+
+    def extract(self, start, size):
+        """`size` bytes of the data from `start` on, zero padded"""
+        d = bytes(self._slice(start, size))
+        return d + b'\x00' * (size - len(d))
+
     def extract_all(self):
-        d = self.data[self.offset: self.offset + self.size]
-        d += [0] * (self.size - len(d))
-        return b''.join([ascii_chr(x) for x in d])
+        return self.extract(0, self.size)
 
     def extract32(self, i):
-        if i >= self.size:
+        o = self._slice(i, 32)
+        if not o:
             return 0
-        o = self.data[self.offset + i: min(self.offset + i + 32, self.rlimit)]
-        return utils.bytearray_to_int(o + [0] * (32 - len(o)))
+        return int(binascii.hexlify(o), 16) << (8 * (32 - len(o)))
 
     def extract_copy(self, mem, memstart, datastart, size):
-        for i in range(size):
-            if datastart + i < self.size:
-                mem[memstart + i] = self.data[self.offset + datastart + i]
-            else:
-                mem[memstart + i] = 0
+        if size:
+            d = self._slice(datastart, size)
+            mem[memstart: memstart + len(d)] = d
+            mem[memstart + len(d): memstart + size] = bytearray(size - len(d))
 
 
 class Message(object):
@@ -75,7 +97,7 @@ class Message(object):
 class Compustate():
 
     def __init__(self, **kwargs):
-        self.memory = []
+        self.memory = bytearray()
         self.stack = []
         self.pc = 0
         self.gas = 0
@@ -121,10 +143,19 @@ def mem_extend(mem, compustate, op, start, sz):
                 return False
             compustate.gas -= memfee
             m_extend = (newsize - oldsize) * 32
-            mem.extend([0] * m_extend)
+            mem.extend(bytearray(m_extend))
     return True
 
 
+def mem_copy(mem, start, data, datastart, size):
+    # copies data[datastart: datastart + size] to the extended memory,
+    # reading zeros past the end of data
+    if size:
+        d = data[datastart: datastart + size]
+        mem[start: start + len(d)] = d
+        mem[start + len(d): start + size] = bytearray(size - len(d))
+
+
 def data_copy(compustate, size):
     if size:
         copyfee = opcodes.GCOPY * utils.ceil32(size) // 32
@@ -144,23 +175,28 @@ def peaceful_exit(cause, gas, data, **kargs):
     log_vm_exit.trace('EXIT', cause=cause, **kargs)
     return 1, gas, data
 
-code_cache = {}
+# analyses of code by preprocess_code, about 140 bytes per byte of code
+code_cache = CodeCache(preprocess_code, 140, name=b'vm1')
+
+# Interpreter loop run by vm_execute: 'switch' compares the name of every
+# instruction against the names of the operations, 'table' looks up the
+# handler of its opcode in `handlers`
+INTERPRETER = 'switch'
 
 
-def vm_execute(ext, msg, code):
+def vm_execute(ext, msg, code, interpreter=None):
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
     trace_vm = log_vm_op.is_active('trace')
+    # only the switch interpreter traces
+    if (interpreter or INTERPRETER) == 'table' and not trace_vm:
+        return vm_execute_table(ext, msg, code)
 
     compustate = Compustate(gas=msg.gas)
     stk = compustate.stack
     mem = compustate.memory
 
-    if code in code_cache:
-        processed_code = code_cache[code]
-    else:
-        processed_code = preprocess_code(code)
-        code_cache[code] = processed_code
+    processed_code = code_cache.get(code, ext.code_db)
 
     codelen = len(processed_code)
 
@@ -211,13 +247,10 @@ def vm_execute(ext, msg, code):
                            'CALLCODE', 'CREATE', 'CALLDATACOPY', 'CODECOPY',
                            'EXTCODECOPY'):
                 if len(compustate.memory) < 1024:
-                    trace_data['memory'] = \
-                        b''.join([encode_hex(ascii_chr(x)) for x
-                                  in compustate.memory])
+                    trace_data['memory'] = encode_hex(bytes(compustate.memory))
                 else:
                     trace_data['sha3memory'] = \
-                        encode_hex(utils.sha3(''.join([ascii_chr(x) for
-                                              x in compustate.memory])))
+                        encode_hex(utils.sha3(bytes(compustate.memory)))
             if _prevop in ('SSTORE', 'SLOAD') or steps == 0:
                 trace_data['storage'] = ext.log_storage(msg.to)
             trace_data['gas'] = to_string(compustate.gas + fee)
@@ -326,7 +359,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG PAYING FOR SHA3')
                 if not mem_extend(mem, compustate, op, s0, s1):
                     return vm_exception('OOG EXTENDING MEMORY')
-                data = b''.join(map(ascii_chr, mem[s0: s0 + s1]))
+                data = bytes(mem[s0: s0 + s1])
                 stk.append(utils.big_endian_to_int(utils.sha3(data)))
             elif op == 'ADDRESS':
                 stk.append(utils.coerce_to_int(msg.to))
@@ -358,11 +391,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 if not data_copy(compustate, size):
                     return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s1 + i < len(processed_code):
-                        mem[start + i] = processed_code[s1 + i][4]
-                    else:
-                        mem[start + i] = 0
+                mem_copy(mem, start, code, s1, size)
             elif op == 'GASPRICE':
                 stk.append(ext.tx_gasprice)
             elif op == 'EXTCODESIZE':
@@ -377,11 +406,7 @@ def vm_execute(ext, msg, code):
                     return vm_exception('OOG EXTENDING MEMORY')
                 if not data_copy(compustate, size):
                     return vm_exception('OOG COPY DATA')
-                for i in range(size):
-                    if s2 + i < len(extcode):
-                        mem[start + i] = utils.safe_ord(extcode[s2 + i])
-                    else:
-                        mem[start + i] = 0
+                mem_copy(mem, start, extcode, s2, size)
         elif opcode < 0x50:
             if op == 'BLOCKHASH':
                 stk.append(utils.big_endian_to_int(ext.block_hash(stk.pop())))
@@ -402,16 +427,12 @@ def vm_execute(ext, msg, code):
                 s0 = stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                data = b''.join(map(ascii_chr, mem[s0: s0 + 32]))
-                stk.append(utils.big_endian_to_int(data))
+                stk.append(int(binascii.hexlify(mem[s0: s0 + 32]), 16))
             elif op == 'MSTORE':
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 32):
                     return vm_exception('OOG EXTENDING MEMORY')
-                v = s1
-                for i in range(31, -1, -1):
-                    mem[s0 + i] = v % 256
-                    v //= 256
+                mem[s0: s0 + 32] = binascii.unhexlify('%064x' % s1)
             elif op == 'MSTORE8':
                 s0, s1 = stk.pop(), stk.pop()
                 if not mem_extend(mem, compustate, op, s0, 1):
@@ -484,7 +505,7 @@ def vm_execute(ext, msg, code):
             compustate.gas -= msz * opcodes.GLOGBYTE
             if not mem_extend(mem, compustate, op, mstart, msz):
                 return vm_exception('OOG EXTENDING MEMORY')
-            data = b''.join(map(ascii_chr, mem[mstart: mstart + msz]))
+            data = bytes(mem[mstart: mstart + msz])
             ext.log(msg.to, topics, data)
             log_log.trace('LOG', to=msg.to, topics=topics, data=list(map(utils.safe_ord, data)))
             # print('LOG', msg.to, topics, list(map(ord, data)))
@@ -529,8 +550,7 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
@@ -568,8 +588,7 @@ def vm_execute(ext, msg, code):
                 else:
                     stk.append(1)
                     compustate.gas += gas
-                    for i in range(min(len(data), memoutsz)):
-                        mem[memoutstart + i] = data[i]
+                    mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
             else:
                 compustate.gas -= (gas + extra_gas - submsg_gas)
                 stk.append(0)
@@ -594,6 +613,563 @@ def vm_execute(ext, msg, code):
         #     assert a >= 0 and a < 2**256, (a, op, stk)
 
 
+# Table dispatched interpreter ###############################################
+#
+# Every opcode has a handler called as handler(compustate, stk, mem, ext,
+# msg, item) with `item` the preprocessed instruction. Handlers return
+# `None` to continue with the next instruction, or the result of the
+# execution. Gas and stack size checks are done by the loop.
+
+def _op_stop(cs, stk, mem, ext, msg, item):
+    return peaceful_exit('STOP', cs.gas, [])
+
+
+def _op_add(cs, stk, mem, ext, msg, item):
+    stk.append((stk.pop() + stk.pop()) & TT256M1)
+
+
+def _op_sub(cs, stk, mem, ext, msg, item):
+    stk.append((stk.pop() - stk.pop()) & TT256M1)
+
+
+def _op_mul(cs, stk, mem, ext, msg, item):
+    stk.append((stk.pop() * stk.pop()) & TT256M1)
+
+
+def _op_div(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 // s1)
+
+
+def _op_mod(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 % s1)
+
+
+def _op_sdiv(cs, stk, mem, ext, msg, item):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) // abs(s1) *
+                                  (-1 if s0 * s1 < 0 else 1)) & TT256M1)
+
+
+def _op_smod(cs, stk, mem, ext, msg, item):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) *
+                                  (-1 if s0 < 0 else 1)) & TT256M1)
+
+
+def _op_addmod(cs, stk, mem, ext, msg, item):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 + s1) % s2 if s2 else 0)
+
+
+def _op_mulmod(cs, stk, mem, ext, msg, item):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 * s1) % s2 if s2 else 0)
+
+
+def _op_exp(cs, stk, mem, ext, msg, item):
+    base, exponent = stk.pop(), stk.pop()
+    # fee for exponent is dependent on its bytes
+    nbytes = len(utils.encode_int(exponent))
+    expfee = nbytes * opcodes.GEXPONENTBYTE
+    if cs.gas < expfee:
+        cs.gas = 0
+        return vm_exception('OOG EXPONENT')
+    cs.gas -= expfee
+    stk.append(pow(base, exponent, TT256))
+
+
+def _op_signextend(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 <= 31:
+        testbit = s0 * 8 + 7
+        if s1 & (1 << testbit):
+            stk.append(s1 | (TT256 - (1 << testbit)))
+        else:
+            stk.append(s1 & ((1 << testbit) - 1))
+    else:
+        stk.append(s1)
+
+
+def _op_lt(cs, stk, mem, ext, msg, item):
+    stk.append(1 if stk.pop() < stk.pop() else 0)
+
+
+def _op_gt(cs, stk, mem, ext, msg, item):
+    stk.append(1 if stk.pop() > stk.pop() else 0)
+
+
+def _op_slt(cs, stk, mem, ext, msg, item):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 < s1 else 0)
+
+
+def _op_sgt(cs, stk, mem, ext, msg, item):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 > s1 else 0)
+
+
+def _op_eq(cs, stk, mem, ext, msg, item):
+    stk.append(1 if stk.pop() == stk.pop() else 0)
+
+
+def _op_iszero(cs, stk, mem, ext, msg, item):
+    stk.append(0 if stk.pop() else 1)
+
+
+def _op_and(cs, stk, mem, ext, msg, item):
+    stk.append(stk.pop() & stk.pop())
+
+
+def _op_or(cs, stk, mem, ext, msg, item):
+    stk.append(stk.pop() | stk.pop())
+
+
+def _op_xor(cs, stk, mem, ext, msg, item):
+    stk.append(stk.pop() ^ stk.pop())
+
+
+def _op_not(cs, stk, mem, ext, msg, item):
+    stk.append(TT256M1 - stk.pop())
+
+
+def _op_byte(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 >= 32:
+        stk.append(0)
+    else:
+        stk.append((s1 // 256 ** (31 - s0)) % 256)
+
+
+def _op_sha3(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    cs.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
+    if cs.gas < 0:
+        return vm_exception('OOG PAYING FOR SHA3')
+    if not mem_extend(mem, cs, 'SHA3', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    data = bytes(mem[s0: s0 + s1])
+    stk.append(utils.big_endian_to_int(utils.sha3(data)))
+
+
+def _op_address(cs, stk, mem, ext, msg, item):
+    stk.append(utils.coerce_to_int(msg.to))
+
+
+def _op_balance(cs, stk, mem, ext, msg, item):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(ext.get_balance(addr))
+
+
+def _op_origin(cs, stk, mem, ext, msg, item):
+    stk.append(utils.coerce_to_int(ext.tx_origin))
+
+
+def _op_caller(cs, stk, mem, ext, msg, item):
+    stk.append(utils.coerce_to_int(msg.sender))
+
+
+def _op_callvalue(cs, stk, mem, ext, msg, item):
+    stk.append(msg.value)
+
+
+def _op_calldataload(cs, stk, mem, ext, msg, item):
+    stk.append(msg.data.extract32(stk.pop()))
+
+
+def _op_calldatasize(cs, stk, mem, ext, msg, item):
+    stk.append(msg.data.size)
+
+
+def _op_calldatacopy(cs, stk, mem, ext, msg, item):
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'CALLDATACOPY', mstart, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(cs, size):
+        return vm_exception('OOG COPY DATA')
+    msg.data.extract_copy(mem, mstart, dstart, size)
+
+
+def _op_codesize(cs, stk, mem, ext, msg, item):
+    stk.append(len(cs.code))
+
+
+def _op_codecopy(cs, stk, mem, ext, msg, item):
+    start, s1, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'CODECOPY', start, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(cs, size):
+        return vm_exception('OOG COPY DATA')
+    mem_copy(mem, start, cs.code, s1, size)
+
+
+def _op_gasprice(cs, stk, mem, ext, msg, item):
+    stk.append(ext.tx_gasprice)
+
+
+def _op_extcodesize(cs, stk, mem, ext, msg, item):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    stk.append(len(ext.get_code(addr) or b''))
+
+
+def _op_extcodecopy(cs, stk, mem, ext, msg, item):
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2**160)
+    start, s2, size = stk.pop(), stk.pop(), stk.pop()
+    extcode = ext.get_code(addr) or b''
+    assert utils.is_string(extcode)
+    if not mem_extend(mem, cs, 'EXTCODECOPY', start, size):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if not data_copy(cs, size):
+        return vm_exception('OOG COPY DATA')
+    mem_copy(mem, start, extcode, s2, size)
+
+
+def _op_blockhash(cs, stk, mem, ext, msg, item):
+    stk.append(utils.big_endian_to_int(ext.block_hash(stk.pop())))
+
+
+def _op_coinbase(cs, stk, mem, ext, msg, item):
+    stk.append(utils.big_endian_to_int(ext.block_coinbase))
+
+
+def _op_timestamp(cs, stk, mem, ext, msg, item):
+    stk.append(ext.block_timestamp)
+
+
+def _op_number(cs, stk, mem, ext, msg, item):
+    stk.append(ext.block_number)
+
+
+def _op_difficulty(cs, stk, mem, ext, msg, item):
+    stk.append(ext.block_difficulty)
+
+
+def _op_gaslimit(cs, stk, mem, ext, msg, item):
+    stk.append(ext.block_gas_limit)
+
+
+def _op_pop(cs, stk, mem, ext, msg, item):
+    stk.pop()
+
+
+def _op_mload(cs, stk, mem, ext, msg, item):
+    s0 = stk.pop()
+    if not mem_extend(mem, cs, 'MLOAD', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    stk.append(int(binascii.hexlify(mem[s0: s0 + 32]), 16))
+
+
+def _op_mstore(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'MSTORE', s0, 32):
+        return vm_exception('OOG EXTENDING MEMORY')
+    mem[s0: s0 + 32] = binascii.unhexlify('%064x' % s1)
+
+
+def _op_mstore8(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'MSTORE8', s0, 1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    mem[s0] = s1 % 256
+
+
+def _op_sload(cs, stk, mem, ext, msg, item):
+    stk.append(ext.get_storage_data(msg.to, stk.pop()))
+
+
+def _op_sstore(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if ext.get_storage_data(msg.to, s0):
+        gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
+        refund = 0 if s1 else opcodes.GSTORAGEREFUND
+    else:
+        gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
+        refund = 0
+    if cs.gas < gascost:
+        return vm_exception('OUT OF GAS')
+    cs.gas -= gascost
+    ext.add_refund(refund)  # adds neg gascost as a refund if below zero
+    ext.set_storage_data(msg.to, s0, s1)
+
+
+def _jump(cs, dest):
+    cs.pc = dest
+    code = cs.processed_code
+    opnew = code[dest][6] if dest < len(code) else 'STOP'
+    if opnew != 'JUMPDEST':
+        return vm_exception('BAD JUMPDEST')
+
+
+def _op_jump(cs, stk, mem, ext, msg, item):
+    return _jump(cs, stk.pop())
+
+
+def _op_jumpi(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if s1:
+        return _jump(cs, s0)
+
+
+def _op_pc(cs, stk, mem, ext, msg, item):
+    stk.append(cs.pc - 1)
+
+
+def _op_msize(cs, stk, mem, ext, msg, item):
+    stk.append(len(mem))
+
+
+def _op_gas(cs, stk, mem, ext, msg, item):
+    stk.append(cs.gas)  # AFTER subtracting cost 1
+
+
+def _op_jumpdest(cs, stk, mem, ext, msg, item):
+    pass
+
+
+def _make_push(num):
+    def _op_push(cs, stk, mem, ext, msg, item):
+        cs.pc += num
+        stk.append(item[5])
+    return _op_push
+
+
+def _make_dup(depth):
+    def _op_dup(cs, stk, mem, ext, msg, item):
+        stk.append(stk[-depth])
+    return _op_dup
+
+
+def _make_swap(depth):
+    def _op_swap(cs, stk, mem, ext, msg, item):
+        temp = stk[-depth - 1]
+        stk[-depth - 1] = stk[-1]
+        stk[-1] = temp
+    return _op_swap
+
+
+def _make_log(depth):
+    def _op_log(cs, stk, mem, ext, msg, item):
+        mstart, msz = stk.pop(), stk.pop()
+        topics = [stk.pop() for x in range(depth)]
+        cs.gas -= msz * opcodes.GLOGBYTE
+        if not mem_extend(mem, cs, item[6], mstart, msz):
+            return vm_exception('OOG EXTENDING MEMORY')
+        data = bytes(mem[mstart: mstart + msz])
+        ext.log(msg.to, topics, data)
+        log_log.trace('LOG', to=msg.to, topics=topics, data=list(map(utils.safe_ord, data)))
+    return _op_log
+
+
+def _op_create(cs, stk, mem, ext, msg, item):
+    value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'CREATE', mstart, msz):
+        return vm_exception('OOG EXTENDING MEMORY')
+    if ext.get_balance(msg.to) >= value and msg.depth < 1024:
+        cd = CallData(mem, mstart, msz)
+        create_msg = Message(msg.to, b'', value, cs.gas, cd, msg.depth + 1)
+        o, gas, addr = ext.create(create_msg)
+        if o:
+            stk.append(utils.coerce_to_int(addr))
+            cs.gas = gas
+        else:
+            stk.append(0)
+            cs.gas = 0
+    else:
+        stk.append(0)
+
+
+def _op_call(cs, stk, mem, ext, msg, item):
+    gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
+        stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'CALL', meminstart, meminsz) or \
+            not mem_extend(mem, cs, 'CALL', memoutstart, memoutsz):
+        return vm_exception('OOG EXTENDING MEMORY')
+    to = utils.encode_int(to)
+    to = ((b'\x00' * (32 - len(to))) + to)[12:]
+    extra_gas = (not ext.account_exists(to)) * opcodes.GCALLNEWACCOUNT + \
+        (value > 0) * opcodes.GCALLVALUETRANSFER
+    submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
+    if cs.gas < gas + extra_gas:
+        return vm_exception('OUT OF GAS', needed=gas+extra_gas)
+    if ext.get_balance(msg.to) >= value and msg.depth < 1024:
+        cs.gas -= (gas + extra_gas)
+        cd = CallData(mem, meminstart, meminsz)
+        call_msg = Message(msg.to, to, value, submsg_gas, cd,
+                           msg.depth + 1, code_address=to)
+        result, gas, data = ext.msg(call_msg)
+        if result == 0:
+            stk.append(0)
+        else:
+            stk.append(1)
+            cs.gas += gas
+            mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
+    else:
+        cs.gas -= (gas + extra_gas - submsg_gas)
+        stk.append(0)
+
+
+def _op_callcode(cs, stk, mem, ext, msg, item):
+    op = item[6]
+    if op == 'CALLCODE':
+        gas, to, value, meminstart, meminsz, memoutstart, memoutsz = \
+            stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+    else:
+        gas, to, meminstart, meminsz, memoutstart, memoutsz = \
+            stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop(), stk.pop()
+        value = 0
+    if not mem_extend(mem, cs, op, meminstart, meminsz) or \
+            not mem_extend(mem, cs, op, memoutstart, memoutsz):
+        return vm_exception('OOG EXTENDING MEMORY')
+    extra_gas = (value > 0) * opcodes.GCALLVALUETRANSFER
+    submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
+    if cs.gas < gas + extra_gas:
+        return vm_exception('OUT OF GAS', needed=gas+extra_gas)
+    if ext.get_balance(msg.to) >= value and msg.depth < 1024:
+        cs.gas -= (gas + extra_gas)
+        to = utils.encode_int(to)
+        to = ((b'\x00' * (32 - len(to))) + to)[12:]
+        cd = CallData(mem, meminstart, meminsz)
+        if ext.post_homestead_hardfork() and op == 'DELEGATECALL':
+            call_msg = Message(msg.sender, msg.to, msg.value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to, transfers_value=False)
+        elif op == 'DELEGATECALL':
+            return vm_exception('OPCODE INACTIVE')
+        else:
+            call_msg = Message(msg.to, msg.to, value, submsg_gas, cd,
+                               msg.depth + 1, code_address=to)
+        result, gas, data = ext.msg(call_msg)
+        if result == 0:
+            stk.append(0)
+        else:
+            stk.append(1)
+            cs.gas += gas
+            mem_copy(mem, memoutstart, data, 0, min(len(data), memoutsz))
+    else:
+        cs.gas -= (gas + extra_gas - submsg_gas)
+        stk.append(0)
+
+
+def _op_return(cs, stk, mem, ext, msg, item):
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, cs, 'RETURN', s0, s1):
+        return vm_exception('OOG EXTENDING MEMORY')
+    return peaceful_exit('RETURN', cs.gas, mem[s0: s0 + s1])
+
+
+def _op_suicide(cs, stk, mem, ext, msg, item):
+    to = utils.encode_int(stk.pop())
+    to = ((b'\x00' * (32 - len(to))) + to)[12:]
+    xfer = ext.get_balance(msg.to)
+    ext.set_balance(to, ext.get_balance(to) + xfer)
+    ext.set_balance(msg.to, 0)
+    ext.add_suicide(msg.to)
+    return 1, cs.gas, []
+
+
+def _op_invalid(cs, stk, mem, ext, msg, item):
+    return vm_exception('INVALID OP', opcode=item[4])
+
+
+def _make_handlers():
+    named = dict(
+        STOP=_op_stop, ADD=_op_add, SUB=_op_sub, MUL=_op_mul, DIV=_op_div,
+        MOD=_op_mod, SDIV=_op_sdiv, SMOD=_op_smod, ADDMOD=_op_addmod,
+        MULMOD=_op_mulmod, EXP=_op_exp, SIGNEXTEND=_op_signextend,
+        LT=_op_lt, GT=_op_gt, SLT=_op_slt, SGT=_op_sgt, EQ=_op_eq,
+        ISZERO=_op_iszero, AND=_op_and, OR=_op_or, XOR=_op_xor,
+        NOT=_op_not, BYTE=_op_byte, SHA3=_op_sha3, ADDRESS=_op_address,
+        BALANCE=_op_balance, ORIGIN=_op_origin, CALLER=_op_caller,
+        CALLVALUE=_op_callvalue, CALLDATALOAD=_op_calldataload,
+        CALLDATASIZE=_op_calldatasize, CALLDATACOPY=_op_calldatacopy,
+        CODESIZE=_op_codesize, CODECOPY=_op_codecopy,
+        GASPRICE=_op_gasprice, EXTCODESIZE=_op_extcodesize,
+        EXTCODECOPY=_op_extcodecopy, BLOCKHASH=_op_blockhash,
+        COINBASE=_op_coinbase, TIMESTAMP=_op_timestamp,
+        NUMBER=_op_number, DIFFICULTY=_op_difficulty,
+        GASLIMIT=_op_gaslimit, POP=_op_pop, MLOAD=_op_mload,
+        MSTORE=_op_mstore, MSTORE8=_op_mstore8, SLOAD=_op_sload,
+        SSTORE=_op_sstore, JUMP=_op_jump, JUMPI=_op_jumpi, PC=_op_pc,
+        MSIZE=_op_msize, GAS=_op_gas, JUMPDEST=_op_jumpdest,
+        CREATE=_op_create, CALL=_op_call, CALLCODE=_op_callcode,
+        DELEGATECALL=_op_callcode, RETURN=_op_return,
+        SUICIDE=_op_suicide)
+    for prefix, make in (('PUSH', _make_push), ('DUP', _make_dup),
+                         ('SWAP', _make_swap), ('LOG', _make_log)):
+        for op, in_args, out_args, fee in opcodes.opcodes.values():
+            if op.startswith(prefix):
+                named[op] = make(int(op[len(prefix):]))
+    handlers = [_op_invalid] * 256
+    for opcode, (op, in_args, out_args, fee) in opcodes.opcodes.items():
+        handlers[opcode] = named[op]
+    return handlers
+
+# handler of every opcode
+handlers = _make_handlers()
+
+
+def _table_instructions(processed_code):
+    return [(_op_invalid if op == 'INVALID' else handlers[opcode],
+             in_args, out_args, fee, opcode, pushval, op)
+            for op, in_args, out_args, fee, opcode, pushval
+            in processed_code]
+
+
+def preprocess_code_table(code):
+    """Preprocess code for :func:`vm_execute_table`.
+
+    Every instruction becomes `(handler, in_args, out_args, fee, opcode,
+    pushval, op)`.
+    """
+    return _table_instructions(preprocess_code(code))
+
+# the handlers cannot be persisted, analyses are made from the persisted ones
+# of code_cache
+table_code_cache = CodeCache(_table_instructions, 120, base=code_cache)
+
+
+def vm_execute_table(ext, msg, code):
+    """Execute code like :func:`vm_execute`, dispatching every instruction
+    to the handler of its opcode. Does not support tracing.
+    """
+    processed_code = table_code_cache.get(code, ext.code_db)
+
+    compustate = Compustate(gas=msg.gas, code=code,
+                            processed_code=processed_code)
+    stk = compustate.stack
+    mem = compustate.memory
+    codelen = len(processed_code)
+
+    while 1:
+        if compustate.pc >= codelen:
+            return peaceful_exit('CODE OUT OF RANGE', compustate.gas, [])
+
+        item = processed_code[compustate.pc]
+        handler, in_args, out_args, fee, opcode, pushval, op = item
+
+        # out of gas error
+        if fee > compustate.gas:
+            return vm_exception('OUT OF GAS')
+
+        # empty stack error
+        height = len(stk)
+        if in_args > height:
+            return vm_exception('INSUFFICIENT STACK',
+                                op=op, needed=to_string(in_args),
+                                available=to_string(height))
+
+        if height - in_args + out_args > 1024:
+            return vm_exception('STACK SIZE LIMIT EXCEEDED',
+                                op=op, pre_height=to_string(height))
+
+        compustate.gas -= fee
+        compustate.pc += 1
+
+        result = handler(compustate, stk, mem, ext, msg, item)
+        if result is not None:
+            return result
+
+
 class VmExtBase():
 
     def __init__(self):
@@ -611,6 +1187,7 @@ class VmExtBase():
         self.block_number = 0
         self.block_difficulty = 0
         self.block_gas_limit = 0
+        self.code_db = None
         self.log = lambda addr, topics, data: 0
         self.tx_origin = b'0' * 40
         self.tx_gasprice = 0